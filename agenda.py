@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""agenda.py
+
+Udacity conference server-side Python App Engine agenda building: finds
+the overlapping sessions of a wishlist and a conflict-free schedule with
+sorted interval sweeps, O(n log n) in the number of sessions
+
+"""
+
+import datetime
+
+
+def sessionInterval(sess):
+    """Return (start, end) datetimes of sess, None without date or
+    start time."""
+    if not sess.date or not sess.startTime:
+        return None
+    start = datetime.datetime.combine(sess.date, sess.startTime)
+    return start, start + datetime.timedelta(minutes=sess.duration or 0)
+
+
+def buildAgenda(sessions):
+    """Return (schedule, conflicts, unscheduled) for sessions.
+
+    schedule is the largest set of sessions that do not overlap, in time
+    order (earliest end first greedy); conflicts the groups of sessions
+    overlapping each other directly or through a chain, in time order;
+    unscheduled the sessions without date or start time.
+    """
+    timed = []
+    unscheduled = []
+    for sess in sessions:
+        interval = sessionInterval(sess)
+        if interval:
+            timed.append((interval, sess))
+        else:
+            unscheduled.append(sess)
+
+    conflicts = []
+    group = []
+    group_end = None
+    for (start, end), sess in sorted(timed, key=lambda t: t[0]):
+        if group and start < group_end:
+            group.append(sess)
+            group_end = max(group_end, end)
+        else:
+            if len(group) > 1:
+                conflicts.append(group)
+            group, group_end = [sess], end
+    if len(group) > 1:
+        conflicts.append(group)
+
+    schedule = []
+    last_end = None
+    for (start, end), sess in sorted(timed, key=lambda t: (t[0][1], t[0][0])):
+        if last_end is None or start >= last_end:
+            schedule.append(sess)
+            last_end = end
+    return schedule, conflicts, unscheduled
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+
+"""benchmark.py
+
+Udacity conference server-side Python App Engine offline benchmark of the
+Conference API against the testbed datastore, memcache and task queue
+stubs
+
+    python benchmark.py --sdk ~/google_appengine --conferences 10000
+
+Generates a synthetic catalog of conferences, sessions, speakers and
+profiles (the same for a given --seed), then drives queryConferences,
+registerForConference, createSession and _cacheAnnouncement and reports
+their throughput, p50/p99 latency and API RPCs per operation. Tasks are
+enqueued but never run.
+
+    python benchmark.py --sdk ~/google_appengine --stress --threads 20
+
+instead fires parallel registrations and unregistrations of many users
+at one conference, reports the transaction retry and abort rates and the
+throughput, and checks that the seats left match the registrations.
+
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+CITIES = ('London', 'Paris', 'Berlin', 'Tokyo', 'Chicago', 'San Francisco',
+          'Madrid', 'Toronto', 'Sydney', 'Mumbai')
+TOPICS = ('Web Technologies', 'Programming Languages', 'Movie Making',
+          'Health and Nutrition', 'Cloud', 'Data', 'Mobile', 'Security')
+PUT_BATCH_SIZE = 500
+
+
+def setupSdk(sdk_path):
+    """Put the App Engine SDK and its bundled libraries on sys.path."""
+    if sdk_path:
+        sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+
+def percentile(values, q):
+    """Return the q (0 to 1) percentile of the sorted values."""
+    if not values:
+        return 0.0
+    return values[int(round((len(values) - 1) * q))]
+
+
+class Harness(object):
+    """Testbed stubs, a synthetic catalog and timed calls of the API."""
+
+    def __init__(self, seed=0):
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.random = random.Random(seed)
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='benchmark', overwrite=True)
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_user_stub()
+        self.testbed.init_urlfetch_stub()
+
+        # the testbed replaced the apiproxy; count the RPCs of its stubs
+        self.rpcs = {}
+        self.transactions = {'begun': 0, 'commits': 0, 'failed_commits': 0}
+        self.lock = threading.Lock()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'benchmark', self._countRpc)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'benchmark', self._countTransaction, 'datastore_v3')
+        import instrumentation
+        instrumentation.installHooks()
+
+        self.profiles = []
+        self.speakers = []
+        self.conferences = []
+
+    def close(self):
+        self.testbed.deactivate()
+
+    def _countRpc(self, service, call, request, response):
+        with self.lock:
+            self.rpcs[service] = self.rpcs.get(service, 0) + 1
+
+    def _countTransaction(self, service, call, request, response, rpc, error):
+        with self.lock:
+            if call == 'BeginTransaction':
+                self.transactions['begun'] += 1
+            elif call == 'Commit':
+                self.transactions['commits'] += 1
+                if error is not None:
+                    self.transactions['failed_commits'] += 1
+
+    def asUser(self, email):
+        """Make email the signed in endpoints user."""
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+
+    def newRequest(self):
+        """Start a new simulated request: empty ndb in-context cache and a
+        new service instance (and with it new request caches)."""
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        ndb.get_context().clear_cache()
+        return ConferenceApi()
+
+    def _putAll(self, entities):
+        from google.appengine.ext import ndb
+        for i in range(0, len(entities), PUT_BATCH_SIZE):
+            ndb.put_multi(entities[i:i + PUT_BATCH_SIZE])
+
+    def generateCatalog(self, conferences, sessions_per_conference=3,
+                        profiles=None, speakers=None):
+        """Put a synthetic catalog; profiles and speakers default to
+        one per conference and one per five conferences."""
+        from google.appengine.ext import ndb
+        from models import Conference, Profile, Session, Speaker
+        import seats
+
+        rnd = self.random
+        profiles = profiles or max(conferences, 10)
+        speakers = speakers or max(conferences // 5, 1)
+
+        entities = []
+        for i in range(profiles):
+            email = 'user%d@example.com' % i
+            self.profiles.append(email)
+            entities.append(Profile(key=ndb.Key(Profile, email), displayName='User %d' % i,
+                                    mainEmail=email))
+        for i in range(speakers):
+            speaker = Speaker(displayName='Speaker %d' % i,
+                              mainEmail='speaker%d@example.com' % i)
+            speaker.key = ndb.Key(Speaker, i + 1)
+            self.speakers.append(speaker.key)
+            entities.append(speaker)
+        self._putAll(entities)
+
+        first = datetime.date(2027, 1, 1)
+        for i in range(0, conferences, PUT_BATCH_SIZE):
+            entities = []
+            for j in range(i, min(i + PUT_BATCH_SIZE, conferences)):
+                organizer = rnd.choice(self.profiles)
+                start = first + datetime.timedelta(days=rnd.randrange(365))
+                max_attendees = rnd.randrange(10, 500)
+                conf = Conference(
+                    key=ndb.Key(Conference, j + 1, parent=ndb.Key(Profile, organizer)),
+                    name='Conference %d' % j,
+                    description='Synthetic conference %d' % j,
+                    organizerUserId=organizer,
+                    topics=rnd.sample(TOPICS, rnd.randrange(1, 4)),
+                    city=rnd.choice(CITIES),
+                    startDate=start,
+                    month=start.month,
+                    endDate=start + datetime.timedelta(days=2),
+                    maxAttendees=max_attendees,
+                    seatsAvailable=max_attendees,
+                    seatShards=seats.shardCount(max_attendees))
+                self.conferences.append((conf.key, organizer))
+                entities.append(conf)
+                entities.extend(seats.makeShards(conf.key, max_attendees, conf.seatShards))
+                for k in range(sessions_per_conference):
+                    entities.append(Session(
+                        parent=conf.key,
+                        sessionName='Session %d of %d' % (k, j),
+                        highlights='Synthetic session',
+                        speaker=rnd.choice(self.speakers),
+                        duration=rnd.choice((30, 45, 60, 90, 120)),
+                        typeOfSession=rnd.choice(('LECTURE', 'WORKSHOP', 'KEYNOTE')),
+                        date=start + datetime.timedelta(days=rnd.randrange(3)),
+                        startTime=datetime.time(rnd.randrange(8, 21), rnd.choice((0, 30)))))
+            self._putAll(entities)
+
+    def measure(self, name, operation, count):
+        """Run operation() count times; return dict of the results."""
+        from protorpc import remote
+        latencies = []
+        errors = 0
+        rpcs_before = dict(self.rpcs)
+        started = time.time()
+        for i in range(count):
+            start = time.time()
+            try:
+                operation()
+            except remote.ApplicationError:
+                # endpoints exceptions, e.g. a conference already sold out
+                errors += 1
+            latencies.append((time.time() - start) * 1000)
+        elapsed = time.time() - started
+        latencies.sort()
+        rpcs = dict((service, n - rpcs_before.get(service, 0))
+                    for service, n in self.rpcs.items())
+        return {
+            'name': name,
+            'count': count,
+            'errors': errors,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'rpcs': sum(rpcs.values()) / float(count),
+            'datastore': rpcs.get('datastore_v3', 0) / float(count),
+            'memcache': rpcs.get('memcache', 0) / float(count),
+        }
+
+    # operations
+
+    def queryConferences(self, filters=()):
+        from models import ConferenceQueryForm, ConferenceQueryForms
+        self.asUser('')
+        self.newRequest().queryConferences(ConferenceQueryForms(
+            filters=[ConferenceQueryForm(field=f, operator=o, value=v)
+                     for f, o, v in filters],
+            pageSize=20))
+
+    def register(self, email=None, conf_key=None, reg=True):
+        import conference
+        self.asUser(email or self.random.choice(self.profiles))
+        conf_key = conf_key or self.random.choice(self.conferences)[0]
+        request = conference.CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=conf_key.urlsafe())
+        api = self.newRequest()
+        if reg:
+            return api.registerForConference(request).data
+        return api.unregisterFromConference(request).data
+
+    def createSession(self):
+        import conference
+        from models import SessionTypes
+        conf_key, organizer = self.random.choice(self.conferences)
+        self.asUser(organizer)
+        self.newRequest().createSession(
+            conference.SESSION_POST_REQUEST.combined_message_class(
+                sessionName='Benchmark session',
+                highlights='Created by the benchmark',
+                speaker=self.random.choice(self.speakers).urlsafe(),
+                duration=60,
+                typeOfSession=SessionTypes.LECTURE,
+                date='2027-06-01',
+                startTime='10:00',
+                websafeConferenceKey=conf_key.urlsafe()))
+
+    def cacheAnnouncement(self):
+        from conference import ConferenceApi
+        self.newRequest()
+        ConferenceApi._cacheAnnouncement()
+
+    def stressRegistrations(self, users, threads, operations, max_attendees,
+                            unregister_rate=0.3):
+        """Register and unregister random users at one conference from
+        parallel threads; return dict of the results.
+
+        Calls ConferenceApi._registerProfile directly, as the endpoints
+        user of the environment is shared by the threads.
+        """
+        from google.appengine.api import datastore_errors
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        from models import ConflictException, Registration
+        import seats
+
+        self.generateCatalog(1, 0, profiles=users, speakers=1)
+        conf_key = self.conferences[0][0]
+        conf = conf_key.get()
+        conf.maxAttendees = conf.seatsAvailable = max_attendees
+        conf.seatShards = seats.shardCount(max_attendees)
+        ndb.put_multi([conf] + seats.makeShards(conf_key, max_attendees, conf.seatShards))
+
+        counts = {'registered': 0, 'unregistered': 0, 'conflicts': 0, 'aborts': 0}
+        before = dict(self.transactions)
+        per_thread = [operations // threads + (1 if i < operations % threads else 0)
+                      for i in range(threads)]
+
+        def worker(n, seed):
+            rnd = random.Random(seed)
+            for i in range(n):
+                ndb.get_context().clear_cache()
+                p_key = ndb.Key('Profile', rnd.choice(self.profiles))
+                reg = rnd.random() >= unregister_rate
+                try:
+                    changed = ConferenceApi._registerProfile(p_key, conf_key.get(), reg)
+                    result = ('registered' if reg else 'unregistered') if changed else 'conflicts'
+                except ConflictException:
+                    result = 'conflicts'
+                except datastore_errors.TransactionFailedError:
+                    result = 'aborts'
+                with self.lock:
+                    counts[result] += 1
+
+        workers = [threading.Thread(target=worker, args=(n, self.random.random()))
+                   for n in per_thread]
+        started = time.time()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.time() - started
+
+        # seats must match the registrations, in the shards and once synced
+        ndb.get_context().clear_cache()
+        registrations = Registration.query(Registration.conference == conf_key).count()
+        shards = ndb.get_multi(seats.shardKeys(conf_key, conf_key.get().seatShards))
+        shard_seats = sum(shard.seatsAvailable for shard in shards)
+        seats.syncSeats(conf_key.urlsafe())
+        ndb.get_context().clear_cache()
+        synced = conf_key.get().seatsAvailable
+
+        # every commit failing on contention is retried by ndb (or aborts)
+        failed = self.transactions['failed_commits'] - before['failed_commits']
+        return dict(counts,
+            operations=operations,
+            throughput=operations / elapsed if elapsed else 0.0,
+            transactions=self.transactions['begun'] - before['begun'],
+            retry_rate=failed / float(operations),
+            abort_rate=counts['aborts'] / float(operations),
+            failed_commits=failed,
+            registrations=registrations,
+            expected_seats=max_attendees - registrations,
+            shard_seats=shard_seats,
+            synced_seats=synced,
+            negative_shards=sum(1 for shard in shards if shard.seatsAvailable < 0),
+            drift=(shard_seats != max_attendees - registrations or
+                   synced != shard_seats or registrations > max_attendees))
+
+
+def report(results):
+    """Print the results as a table."""
+    print '%-28s %7s %6s %9s %9s %9s %8s %8s %8s' % (
+        'operation', 'ops', 'errors', 'ops/s', 'p50 ms', 'p99 ms',
+        'rpcs/op', 'ds/op', 'mc/op')
+    for r in results:
+        print '%-28s %7d %6d %9.1f %9.2f %9.2f %8.1f %8.1f %8.1f' % (
+            r['name'], r['count'], r['errors'], r['throughput'], r['p50'],
+            r['p99'], r['rpcs'], r['datastore'], r['memcache'])
+
+
+def reportStress(r):
+    """Print the results of a registration stress run."""
+    print ('%(operations)d operations at %(throughput).1f ops/s: %(registered)d '
+           'registered, %(unregistered)d unregistered, %(conflicts)d conflicts, '
+           '%(aborts)d aborts' % r)
+    print ('%(transactions)d transactions begun, retry rate %(retry_rate).3f, '
+           'abort rate %(abort_rate).3f, %(failed_commits)d failed commits' % r)
+    print ('%(registrations)d registrations, seats left: expected %(expected_seats)d, '
+           'shards %(shard_seats)d, conference %(synced_seats)d, '
+           '%(negative_shards)d negative shards' % r)
+    print 'SEAT DRIFT' if r['drift'] else 'no seat drift'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', help='path of the App Engine SDK (google_appengine)')
+    parser.add_argument('--conferences', type=int, default=10000)
+    parser.add_argument('--sessions', type=int, default=3,
+                        help='sessions per conference')
+    parser.add_argument('--profiles', type=int, default=None)
+    parser.add_argument('--speakers', type=int, default=None)
+    parser.add_argument('--operations', type=int, default=200,
+                        help='calls per operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stress', action='store_true',
+                        help='run the concurrent registration stress test instead')
+    parser.add_argument('--users', type=int, default=500,
+                        help='simulated users of the stress test')
+    parser.add_argument('--threads', type=int, default=20,
+                        help='parallel threads of the stress test')
+    parser.add_argument('--seats', type=int, default=100,
+                        help='maxAttendees of the stress test conference')
+    args = parser.parse_args(argv)
+
+    setupSdk(args.sdk)
+    harness = Harness(args.seed)
+    try:
+        if args.stress:
+            result = harness.stressRegistrations(
+                args.users, args.threads, args.operations, args.seats)
+            reportStress(result)
+            return 1 if result['drift'] else 0
+
+        started = time.time()
+        harness.generateCatalog(args.conferences, args.sessions,
+                                args.profiles, args.speakers)
+        print 'catalog of %d conferences generated in %.1fs' % (
+            args.conferences, time.time() - started)
+
+        n = args.operations
+        report([
+            harness.measure('queryConferences', harness.queryConferences, n),
+            harness.measure('queryConferences city', lambda: harness.queryConferences(
+                [('CITY', 'EQ', harness.random.choice(CITIES))]), n),
+            harness.measure('queryConferences topic+month', lambda: harness.queryConferences(
+                [('TOPIC', 'EQ', harness.random.choice(TOPICS)), ('MONTH', 'GTEQ', '6')]), n),
+            harness.measure('registerForConference', harness.register, n),
+            harness.measure('createSession', harness.createSession, n),
+            harness.measure('_cacheAnnouncement', harness.cacheAnnouncement, max(n // 10, 1)),
+        ])
+    finally:
+        harness.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""bulk.py
+
+Udacity conference server-side Python App Engine bulk import/export of
+Conference, Session and Speaker entities as JSON lines
+
+Each line is a JSON object with the "kind" of the entity, its "key" as a
+list of (kind, id) pairs and its properties. Dates are "YYYY-MM-DD",
+times "HH:MM:SS" and keys lists of pairs, so an export imports into
+another application as is. Lines without "key" get a new ID; a Conference
+needs "organizerUserId" and a Session "conference" (key pairs) then.
+
+"""
+
+import datetime
+import json
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import Speaker
+from conference import ConferenceApi
+import cache
+import catalog
+import facets
+import search
+import seats
+
+EXPORT_KINDS = ('Conference', 'Session', 'Speaker')
+MODELS = {
+    'Conference': Conference,
+    'Session': Session,
+    'Speaker': Speaker,
+}
+EXPORT_BATCH_SIZE = 500
+EXPORT_LIMIT = 20000
+IMPORT_BATCH_SIZE = 200
+
+
+class ImportFailed(ValueError):
+    """Raised by importLines on an invalid line. The batches before the
+    one of the line are committed: counts has the entities imported and
+    committedThrough the number of the last line committed."""
+
+    def __init__(self, line, error, counts, committed_through):
+        ValueError.__init__(self, 'Invalid import line %d: %s' % (line, error))
+        self.line = line
+        self.counts = counts
+        self.committedThrough = committed_through
+
+
+def _encode(value):
+    """Return the JSON value of a property value."""
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+    if isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, datetime.time):
+        return value.strftime('%H:%M:%S')
+    if isinstance(value, ndb.Key):
+        return [list(pair) for pair in value.pairs()]
+    return value
+
+
+def _decode(prop, value):
+    """Return the property value of a JSON value."""
+    if prop._repeated:
+        return [_decodeOne(prop, v) for v in value or []]
+    return _decodeOne(prop, value)
+
+
+def _decodeOne(prop, value):
+    if value is None:
+        return None
+    if isinstance(prop, ndb.DateTimeProperty):
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+    if isinstance(prop, ndb.DateProperty):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    if isinstance(prop, ndb.TimeProperty):
+        return datetime.datetime.strptime(value, '%H:%M:%S').time()
+    if isinstance(prop, ndb.KeyProperty):
+        return ndb.Key(pairs=[tuple(pair) for pair in value])
+    return value
+
+
+def _stored(model_class):
+    """Return the (name, property) pairs exported for model_class."""
+    return [(name, prop) for name, prop in sorted(model_class._properties.items())
+            if not isinstance(prop, ndb.ComputedProperty)]
+
+
+def toJson(entity):
+    """Return the JSON line of entity."""
+    data = {'kind': entity._get_kind(), 'key': _encode(entity.key)}
+    for name, prop in _stored(type(entity)):
+        data[name] = _encode(prop._get_value(entity))
+    return json.dumps(data, sort_keys=True)
+
+
+def exportLines(write, position=None, limit=EXPORT_LIMIT):
+    """Write the JSON lines of the entities with write(), walking each kind
+    with query cursors from position ("Kind" or "Kind:cursor").
+
+    Stops after about limit entities and returns the position to resume
+    from, or None once every kind was exported.
+    """
+    kind, cursor = (position or EXPORT_KINDS[0]).partition(':')[::2]
+    if kind not in EXPORT_KINDS:
+        raise ValueError('Invalid export position: %s' % position)
+    kinds = EXPORT_KINDS[EXPORT_KINDS.index(kind):]
+    try:
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    except datastore_errors.BadValueError:
+        raise ValueError('Invalid export position: %s' % position)
+    exported = 0
+
+    for kind in kinds:
+        query = MODELS[kind].query()
+        more = True
+        while more:
+            if exported >= limit:
+                return '%s:%s' % (kind, start_cursor.urlsafe()) if start_cursor else kind
+            entities, start_cursor, more = query.fetch_page(
+                EXPORT_BATCH_SIZE, start_cursor=start_cursor)
+            for entity in entities:
+                write(toJson(entity) + '\n')
+            exported += len(entities)
+            more = more and start_cursor is not None
+        start_cursor = None
+    return None
+
+
+def importLines(lines, batch_size=IMPORT_BATCH_SIZE):
+    """Import the JSON lines read from lines in batches of batch_size;
+    return dict of kind -> number of entities imported.
+
+    Raises ImportFailed on an invalid line, nothing of its batch being
+    written.
+    """
+    counts = dict((kind, 0) for kind in EXPORT_KINDS)
+    committed = 0
+    batch = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            batch.append((number, json.loads(line)))
+        except ValueError as e:
+            raise ImportFailed(number, e, counts, committed)
+        if len(batch) >= batch_size:
+            _importBatch(batch, counts, committed)
+            committed = batch[-1][0]
+            batch = []
+    if batch:
+        _importBatch(batch, counts, committed)
+    return counts
+
+
+def reputPage(kind, cursor=None, batch_size=IMPORT_BATCH_SIZE):
+    """Put one page of the entities of kind again, so that their computed
+    properties are stored and indexed, and (re)index them for full-text
+    search; return the urlsafe cursor of the next page (None after the
+    last one).
+    """
+    if kind not in MODELS:
+        raise ValueError('Invalid kind: %s' % kind)
+    entities, next_cursor, more = MODELS[kind].query().fetch_page(
+        batch_size, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    ndb.put_multi(entities)
+    cache.invalidateEntities([entity.key for entity in entities])
+    if kind in search.INDEXED_FIELDS:
+        search.scheduleIndex([entity.key for entity in entities])
+    return next_cursor.urlsafe() if more and next_cursor else None
+
+
+def _parentKey(kind, record):
+    """Return the parent key of a new entity of kind from its record."""
+    if kind == 'Conference':
+        return ndb.Key(Profile, record['organizerUserId'])
+    if kind == 'Session':
+        return ndb.Key(pairs=[tuple(pair) for pair in record['conference']])
+    return None
+
+
+def _importBatch(records, counts, committed):
+    """Put the entities of records, (line number, record) pairs, with one
+    put_multi and add them to counts; the new ones get their IDs from one
+    allocate_ids range per kind and parent. committed is the last line
+    number committed before, for ImportFailed."""
+    entities = []
+    new = {}
+    added = dict((kind, 0) for kind in EXPORT_KINDS)
+    for number, record in records:
+        try:
+            kind = record['kind']
+            model_class = MODELS[kind]
+            data = dict((name, _decode(prop, record[name]))
+                        for name, prop in _stored(model_class) if name in record)
+            entity = model_class(**data)
+            if record.get('key'):
+                entity.key = ndb.Key(pairs=[tuple(pair) for pair in record['key']])
+            else:
+                new.setdefault((kind, _parentKey(kind, record)), []).append(entity)
+        except (ValueError, KeyError, TypeError, datastore_errors.BadValueError) as e:
+            raise ImportFailed(number, e, counts, committed)
+        entities.append(entity)
+        added[kind] += 1
+
+    for (kind, parent), group in new.items():
+        first_id, last_id = MODELS[kind].allocate_ids(size=len(group), parent=parent)
+        for i, entity in enumerate(group):
+            entity.key = ndb.Key(kind, first_id + i, parent=parent)
+
+    confs = [entity for entity in entities if isinstance(entity, Conference)]
+    # conferences imported over existing ones replace their facet values
+    replaced = ndb.get_multi([conf.key for conf in confs])
+    deltas = {}
+    extra = []
+    seat_deltas = []
+    for conf, old in zip(confs, replaced):
+        extra.extend(_prepareConference(conf, old))
+        if old and old.seatShards:
+            seat_deltas.append((conf.key, (conf.maxAttendees or 0) - (old.maxAttendees or 0)))
+        facets.mergeDeltas(deltas, facets.countDeltas(
+            facets.facetValues(old), facets.facetValues(conf)))
+    ndb.put_multi(entities + extra)
+    for kind, n in added.items():
+        counts[kind] += n
+    cache.invalidateEntities([entity.key for entity in entities])
+    # the shards of replaced conferences follow their new maxAttendees
+    for conf_key, delta in seat_deltas:
+        if delta:
+            seats.adjustSeats(conf_key, delta)
+    cache_keys = [seats.SEATS_PREFIX + conf.key.urlsafe() for conf in confs]
+    memcache.delete_multi(cache_keys)
+    cache.bumpVersions(cache_keys)
+
+    sessions = {}
+    for entity in entities:
+        if isinstance(entity, Session):
+            sessions.setdefault(entity.key.parent(), []).append(entity)
+    cache.invalidateCollections('Session', sessions.keys())
+    for conf_key, conf_sessions in sessions.items():
+        ConferenceApi._enqueueFeaturedSpeakers(conf_key, conf_sessions)
+    facets.recordChange(deltas)
+    if confs:
+        catalog.invalidate()
+    search.scheduleIndex([entity.key for entity in entities
+                          if entity._get_kind() in search.INDEXED_FIELDS])
+
+
+def _prepareConference(conf, old=None):
+    """Fill in the derived fields of an imported conference; return its
+    seat shards to put along.
+
+    A conference replacing the stored one old keeps the seats taken: its
+    shards stay (adjusted to maxAttendees after the put), or its seats
+    follow the change of maxAttendees, which never goes below them.
+    """
+    if conf.startDate:
+        conf.month = conf.startDate.month
+    elif conf.month is None:
+        conf.month = 0
+    if old and old.seatShards:
+        conf.seatShards = old.seatShards
+        conf.seatsAvailable = old.seatsAvailable
+        return []
+    if old:
+        delta = (conf.maxAttendees or 0) - (old.maxAttendees or 0)
+        conf.seatsAvailable = (old.seatsAvailable or 0) + delta
+        if conf.seatsAvailable < 0:
+            conf.maxAttendees = (conf.maxAttendees or 0) - conf.seatsAvailable
+            conf.seatsAvailable = 0
+    elif conf.seatsAvailable is None:
+        conf.seatsAvailable = conf.maxAttendees or 0
+    conf.seatShards = seats.shardCount(conf.maxAttendees)
+    return seats.makeShards(conf.key, conf.seatsAvailable, conf.seatShards)
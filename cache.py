@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Udacity conference server-side Python App Engine read-through memcache
+layer for datastore entities, with versioned invalidation and hit/miss
+counters, and ETags derived from the versions
+
+"""
+
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+ENTITY_PREFIX = 'entity:'
+VERSION_PREFIX = 'version:'
+STATS_PREFIX = 'stats:'
+COLLECTION_PREFIX = 'children:'
+ENTITY_CACHE = 'entity'
+ETAG_CACHE = 'etag'
+
+
+def getVersions(names):
+    """Return dict of version name -> current version number.
+
+    A version that is not in memcache (never bumped or evicted) restarts
+    from the current time in milliseconds, so it never hands out a number
+    that was already used for older data.
+    """
+    keys = dict((VERSION_PREFIX + name, name) for name in names)
+    found = memcache.get_multi(keys.keys())
+    missing = dict((key, int(time.time() * 1000))
+                   for key in keys if key not in found)
+    if missing:
+        memcache.add_multi(missing)
+        # another request may have added the version first
+        found.update(memcache.get_multi(missing.keys()))
+    return dict((name, found.get(key, missing.get(key)))
+                for key, name in keys.items())
+
+
+def bumpVersions(names):
+    """Move the versions to a new number, orphaning what was cached.
+
+    Inside a transaction the versions are bumped once it commits.
+    """
+    offsets = dict((VERSION_PREFIX + name, 1) for name in names)
+    if not offsets:
+        return
+    if ndb.in_transaction():
+        ndb.get_context().call_on_commit(
+            lambda: memcache.offset_multi(offsets))
+    else:
+        memcache.offset_multi(offsets)
+
+
+def getEtag(names):
+    """Return an ETag of the current versions of names, which changes
+    whenever one of them is bumped (or evicted)."""
+    versions = getVersions(names)
+    return hashlib.sha1(','.join('%s=%d' % (name, versions[name])
+                                 for name in sorted(set(names)))).hexdigest()[:16]
+
+
+def recordStats(name, hits, misses):
+    """Add hits and misses to the counters of the named cache."""
+    if hits or misses:
+        memcache.Client().offset_multi_async({
+            '%s%s:hits' % (STATS_PREFIX, name): hits,
+            '%s%s:misses' % (STATS_PREFIX, name): misses,
+        }, initial_value=0)
+
+
+def getStats(names):
+    """Return dict of cache name -> (hits, misses)."""
+    counters = memcache.get_multi(['%s%s:%s' % (STATS_PREFIX, name, kind)
+                                   for name in names
+                                   for kind in ('hits', 'misses')])
+    return dict((name, (counters.get('%s%s:hits' % (STATS_PREFIX, name), 0),
+                        counters.get('%s%s:misses' % (STATS_PREFIX, name), 0)))
+                for name in names)
+
+
+def getEntities(keys):
+    """Return the entities for keys, None where there is no entity.
+
+    Entities are read from memcache under their current version and only
+    the misses go to the datastore. Transactions read the datastore
+    directly so that they see (and lock) the committed data.
+    """
+    if ndb.in_transaction():
+        return ndb.get_multi(keys)
+
+    names = [key.urlsafe() for key in keys]
+    versions = getVersions(set(names))
+    cache_keys = ['%s%s:%d' % (ENTITY_PREFIX, name, versions[name])
+                  for name in names]
+    cached = memcache.get_multi(set(cache_keys))
+
+    misses = [i for i, cache_key in enumerate(cache_keys)
+              if cache_key not in cached]
+    entities = [cached.get(cache_key) for cache_key in cache_keys]
+    if misses:
+        fetched = ndb.get_multi([keys[i] for i in misses])
+        for i, entity in zip(misses, fetched):
+            entities[i] = entity
+        memcache.set_multi(dict((cache_keys[i], entity)
+                                for i, entity in zip(misses, fetched)
+                                if entity is not None))
+
+    recordStats(ENTITY_CACHE, len(keys) - len(misses), len(misses))
+    return entities
+
+
+def getEntity(key):
+    """Return the entity for key or None, see getEntities()."""
+    return getEntities([key])[0]
+
+
+def invalidateEntities(keys):
+    """Invalidate the cached copies of the entities after a put()."""
+    bumpVersions([key.urlsafe() for key in keys])
+
+
+def collectionName(kind, parent_key):
+    """Return the version name of the kind children of parent_key."""
+    return '%s%s:%s' % (COLLECTION_PREFIX, kind, parent_key.urlsafe())
+
+
+def invalidateCollections(kind, parent_keys):
+    """Move the versions of the kind children of parent_keys after
+    children were added or replaced."""
+    bumpVersions(set(collectionName(kind, key) for key in parent_keys))
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""catalog.py
+
+Udacity conference server-side Python App Engine in-instance snapshot of
+the conference catalog for queryConferences
+
+The snapshot keeps the filterable fields of every conference as column
+arrays in name order, with row lists per city, topic and month, so the
+filters of queryConferences are answered without a datastore query. It
+is rebuilt from a projection query when the "catalog" version in memcache
+moved (conference writes bump it), at most once per REFRESH_INTERVAL. A
+catalog of more than SNAPSHOT_LIMIT conferences (a keys-only count) gets
+no snapshot, and its size is checked again only every SIZE_CHECK_INTERVAL.
+
+Snapshot cursors hold the (name, key) of the last conference returned,
+so a page continues at the same place on any snapshot, and on the
+datastore (scan()) on an instance without one.
+
+"""
+
+import array
+import base64
+import bisect
+import collections
+import json
+import threading
+import time
+
+from google.appengine.ext import ndb
+
+import cache
+from models import Conference
+
+CATALOG_VERSION = 'catalog'
+CURSOR_PREFIX = 'snap:'
+CHECK_INTERVAL = 5
+REFRESH_INTERVAL = 30
+SNAPSHOT_LIMIT = 20000
+SIZE_CHECK_INTERVAL = 3600
+FETCH_BATCH_SIZE = 1000
+PROJECTION = ('name', 'city', 'topics', 'month', 'maxAttendees')
+# filter field -> name of the row lists answering its equality filters
+INDEXED_FIELDS = {
+    'city': 'byCity',
+    'topics': 'byTopic',
+    'month': 'byMonth',
+}
+
+_state = {'snapshot': None, 'checked': 0, 'built': 0, 'version': None, 'tooBig': 0}
+_buildLock = threading.Lock()
+
+Row = collections.namedtuple('Row', ('key',) + PROJECTION)
+
+
+class Snapshot(object):
+    """Columns of the conferences (Rows) in name order."""
+
+    def __init__(self, version, confs):
+        self.version = version
+        self.keys = tuple(conf.key for conf in confs)
+        self.positions = [_position(conf) for conf in confs]
+        self.columns = {
+            'name': tuple(conf.name for conf in confs),
+            'city': tuple(conf.city for conf in confs),
+            'topics': tuple(tuple(conf.topics) for conf in confs),
+            'month': array.array('i', (conf.month or 0 for conf in confs)),
+            'maxAttendees': array.array('i', (conf.maxAttendees or 0 for conf in confs)),
+        }
+        self.byCity = {}
+        self.byTopic = {}
+        self.byMonth = {}
+        for row, conf in enumerate(confs):
+            self.byCity.setdefault(conf.city, []).append(row)
+            for topic in set(conf.topics):
+                self.byTopic.setdefault(topic, []).append(row)
+            self.byMonth.setdefault(conf.month or 0, []).append(row)
+
+    def query(self, filters, page_size, cursor=None):
+        """Return the keys of one page of the conferences matching filters,
+        a list of (field, operator, compare, value), and the cursor of the
+        next page (None after the last one).
+
+        The rows come from the shortest row list of an equality filter (all
+        rows without one) and are checked against the other filters.
+        """
+        start = 0
+        if cursor:
+            start = bisect.bisect_right(self.positions, decodeCursor(cursor))
+
+        rows = None
+        for field, operator, compare, value in filters:
+            if field in INDEXED_FIELDS and operator == '=':
+                candidates = getattr(self, INDEXED_FIELDS[field]).get(value, [])
+                if rows is None or len(candidates) < len(rows):
+                    rows = candidates
+        if rows is None:
+            rows = xrange(start, len(self.keys))
+        else:
+            rows = rows[bisect.bisect_left(rows, start):]
+
+        keys = []
+        last = None
+        for row in rows:
+            if all(_matches(self.columns[field][row], compare, value)
+                   for field, operator, compare, value in filters):
+                if len(keys) == page_size:
+                    return keys, encodeCursor(self.positions[last])
+                keys.append(self.keys[row])
+                last = row
+        return keys, None
+
+
+def _position(conf):
+    """Return the place of a conference (Row) in the name order."""
+    return (conf.name, conf.key.flat())
+
+
+def _matches(values, compare, value):
+    """Return if a value (any of a list, like topics) matches a filter."""
+    if not isinstance(values, (tuple, list)):
+        values = (values,)
+    return any(v is not None and compare(v, value) for v in values)
+
+
+def encodeCursor(position):
+    """Return the snapshot cursor continuing after position."""
+    name, flat = position
+    key = ndb.Key(flat=flat)
+    return CURSOR_PREFIX + base64.urlsafe_b64encode(json.dumps([name, key.urlsafe()]))
+
+
+def decodeCursor(cursor):
+    """Return the position of a snapshot cursor, ValueError if invalid."""
+    try:
+        name, wsck = json.loads(base64.urlsafe_b64decode(str(cursor[len(CURSOR_PREFIX):])))
+        return (name, ndb.Key(urlsafe=wsck).flat())
+    except Exception:
+        raise ValueError('Invalid cursor: %s' % cursor)
+
+
+def scan(filters, page_size, cursor, scan_limit):
+    """Continue a snapshot cursor on the datastore: return the keys of one
+    page of the conferences after it matching filters (see Snapshot.query)
+    and the cursor of the next page.
+
+    At most scan_limit conferences are examined, so a page may come back
+    short (even empty) with a cursor to continue from.
+    """
+    position = decodeCursor(cursor)
+    query = Conference.query(Conference.name >= position[0]).order(
+        Conference.name, Conference.key)
+    keys = []
+    last = None
+    scanned = 0
+    for conf in query.iter(batch_size=FETCH_BATCH_SIZE):
+        if _position(conf) <= position:
+            # the same name, at or before the cursor
+            continue
+        if scanned == scan_limit:
+            return keys, encodeCursor(_position(last))
+        if all(_matches(getattr(conf, field), compare, value)
+               for field, operator, compare, value in filters):
+            if len(keys) == page_size:
+                return keys, encodeCursor(_position(last))
+            keys.append(conf.key)
+        last = conf
+        scanned += 1
+    return keys, None
+
+
+def _row(conf):
+    """Return the Row of a (projected) Conference."""
+    topics = conf.topics
+    if not isinstance(topics, list):
+        topics = [topics]
+    return Row(conf.key, conf.name, conf.city, list(topics), conf.month,
+               conf.maxAttendees)
+
+
+def buildRows(total):
+    """Return the Rows of the total conferences in (name, key) order.
+
+    The projection query returns a result per topic of a conference and
+    none for a conference missing one of the projected properties; those
+    are read whole.
+    """
+    rows = collections.OrderedDict()
+    query = Conference.query().order(Conference.name)
+    for conf in query.iter(projection=[getattr(Conference, name) for name in PROJECTION],
+                           batch_size=FETCH_BATCH_SIZE):
+        if conf.key in rows:
+            rows[conf.key].topics.extend(_row(conf).topics)
+        else:
+            rows[conf.key] = _row(conf)
+    if len(rows) < total:
+        keys = Conference.query().fetch(SNAPSHOT_LIMIT + 1, keys_only=True,
+                                        batch_size=FETCH_BATCH_SIZE)
+        missing = [key for key in keys if key not in rows]
+        for conf in ndb.get_multi(missing):
+            # the name order leaves out conferences without name
+            if conf and conf.name is not None:
+                rows[conf.key] = _row(conf)
+    # the index orders equal names by the other columns, not by key
+    return sorted(rows.values(), key=_position)
+
+
+def isCursor(cursor):
+    """Return if cursor is a snapshot cursor."""
+    return bool(cursor) and cursor.startswith(CURSOR_PREFIX)
+
+
+def invalidate():
+    """Move the catalog version after a conference write."""
+    cache.bumpVersions([CATALOG_VERSION])
+
+
+def getSnapshot():
+    """Return the snapshot of the instance, None when there is none (yet)
+    or the catalog was larger than SNAPSHOT_LIMIT at the last size check.
+
+    The version is checked at most every CHECK_INTERVAL seconds and one
+    thread at a time rebuilds the snapshot, the others keeping the
+    previous one meanwhile.
+    """
+    now = time.time()
+    if now - _state['checked'] < CHECK_INTERVAL:
+        return _state['snapshot']
+    _state['checked'] = now
+    if now - _state['tooBig'] < SIZE_CHECK_INTERVAL:
+        return None
+    version = cache.getVersions([CATALOG_VERSION])[CATALOG_VERSION]
+    if version == _state['version'] or now - _state['built'] < REFRESH_INTERVAL:
+        return _state['snapshot']
+    if not _buildLock.acquire(False):
+        return _state['snapshot']
+    try:
+        total = Conference.query().count(limit=SNAPSHOT_LIMIT + 1)
+        if total > SNAPSHOT_LIMIT:
+            _state.update(snapshot=None, version=version, built=time.time(),
+                          tooBig=time.time())
+        else:
+            _state.update(snapshot=Snapshot(version, buildRows(total)),
+                          version=version, built=time.time(), tooBig=0)
+    finally:
+        _buildLock.release()
+    return _state['snapshot']
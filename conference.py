@@ -13,13 +13,16 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 import datetime
+import hashlib
 import json
+import operator
 import os
 import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protobuf
 from protorpc import remote
 
 from google.appengine.api import urlfetch
@@ -27,11 +30,16 @@ from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 from google.appengine.ext.db import polymodel
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import ProfileForms
+from models import Registration
+from models import WishlistEntry
 from models import TeeShirtSize
+from models import Announcement
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
@@ -39,21 +47,49 @@ from models import Session
 from models import SessionForm
 from models import SessionForms
 from models import SessionTypes
+from models import AgendaForm
+from models import ConflictForm
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import FacetForm
+from models import FacetForms
+from models import SearchResultForm
+from models import SearchResultForms
 from models import BooleanMessage
 from models import ConflictException
 from models import StringMessage
+from models import CacheStatsForm
+from models import CacheStatsForms
 from models import Speaker
 from models import SpeakerForm
 
 from settings import WEB_CLIENT_ID
 from utils import getUserId
+import agenda
+import cache
+import catalog
+import facets
+import instrumentation
+import notifications
+import search
+import seats
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_NEARLY_SOLD_OUT_KEY = "NEARLY_SOLD_OUT"
+NEARLY_SOLD_OUT_KEY = ndb.Key(Announcement, 'nearly_sold_out')
+NEARLY_SOLD_OUT_SEATS = 5
 MEMCACHE_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_SPEAKER_SESSIONS_PREFIX = "SPEAKER_SESSIONS"
+MEMCACHE_CAS_RETRIES = 5
+MEMCACHE_AGENDA_PREFIX = "AGENDA:"
+AGENDA_CACHE = 'agenda'
+MEMCACHE_PROFILE_PREFIX = "PROFILE:"
+PROFILE_CACHE = 'profile'
+PROFILE_TTL = 60
+ANNOUNCEMENT_VERSION = 'announcement'
+ANNOUNCEMENT_DELETE_LOCK = 5
 DEFAULTS = {
     "city": "Default City",
     "maxAttendees": 0,
@@ -79,13 +115,40 @@ FIELDS =    {
             'MONTH': 'month',
             'MAX_ATTENDEES': 'maxAttendees',
             }
+FILTER_SELECTIVITY = {
+            'city': 4,
+            'maxAttendees': 3,
+            'month': 3,
+            'topics': 2,
+            }
+COMPARATORS = {
+            '=':  operator.eq,
+            '>':  operator.gt,
+            '>=': operator.ge,
+            '<':  operator.lt,
+            '<=': operator.le,
+            '!=': operator.ne,
+            }
+QUERY_BATCH_SIZE = 100
+QUERY_SCAN_LIMIT = 1000
+DEFAULT_PAGE_SIZE = 20
+MAX_SESSIONS_PER_BATCH = 500
+MAX_PAGE_SIZE = 100
+MAX_WISHLIST_SESSIONS = 200
+MIGRATE_BATCH_SIZE = 100
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
+CONF_CONDITIONAL_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
 SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speakerKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
 )
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -99,14 +162,77 @@ SESSION_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     speaker=messages.StringField(1),
     websafeConferenceKey=messages.StringField(2),
 )
+CONF_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    cursor=messages.StringField(2),
+)
+CONF_ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    cursor=messages.StringField(3),
+)
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
 )
+SESSION_QUERY_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    minDuration=messages.IntegerField(1, variant=messages.Variant.INT32),
+    maxDuration=messages.IntegerField(2, variant=messages.Variant.INT32),
+    startAfter=messages.StringField(3),
+    startBefore=messages.StringField(4),
+    excludeTypes=messages.StringField(5, repeated=True),
+    date=messages.StringField(6),
+    pageSize=messages.IntegerField(7, variant=messages.Variant.INT32),
+    cursor=messages.StringField(8),
+)
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    cursor=messages.StringField(3),
+)
+FEATURED_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+ANNOUNCEMENT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1),
 )
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+
+def _formPlan(form_class, model_class, converters):
+    """Return the (field name, converter) pairs copying model_class
+    entities to form_class messages; built once at import time so the
+    copy helpers do not walk all_fields() for every entity.
+    """
+    return tuple((field.name, converters.get(field.name))
+                 for field in form_class.all_fields()
+                 if hasattr(model_class, field.name))
+
+SESSION_TYPES = dict((t.name, t) for t in SessionTypes)
+CONFERENCE_FORM_PLAN = _formPlan(ConferenceForm, Conference, {
+    'startDate': str,
+    'endDate': str,
+})
+SESSION_FORM_PLAN = _formPlan(SessionForm, Session, {
+    'date': str,
+    'startTime': str,
+    'speaker': str,
+    'typeOfSession': SESSION_TYPES.__getitem__,
+})
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -114,6 +240,7 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
                 version='v1',
                 allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID],
                 scopes=[EMAIL_SCOPE])
+@instrumentation.instrumented
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
@@ -125,21 +252,52 @@ class ConferenceApi(remote.Service):
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
         cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        # convert Date to date string; just copy others
+        for name, convert in CONFERENCE_FORM_PLAN:
+            value = getattr(conf, name)
+            setattr(cf, name, convert(value) if convert else value)
+        cf.websafeKey = conf.key.urlsafe()
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
+        # ConferenceForm has no required field, no need to check_initialized()
         return cf
 
 
+    def _requestCache(self, name):
+        """Return the named cache dict shared by the helpers of this request.
+
+        The endpoints server builds a new service instance per request, so
+        the caches never outlive the request.
+        """
+        caches = self.__dict__.setdefault('_requestCaches', {})
+        return caches.setdefault(name, {})
+
+
+    def _getOrganizerNames(self, confs):
+        """Return dict of organizer Profile key -> displayName for confs.
+
+        Organizers not yet in the request name cache are fetched with a
+        single get_multi, so a page costs one RPC whatever its size.
+        """
+        names = self._requestCache('organizerNames')
+        p_keys = list(set(conf.key.parent() for conf in confs) - set(names))
+        if p_keys:
+            for p_key, prof in zip(p_keys, ndb.get_multi(p_keys)):
+                names[p_key] = getattr(prof, 'displayName', None) or ""
+        return names
+
+
+    def _copyConferencesToForms(self, confs):
+        """Copy Conferences to ConferenceForms with their organizer names."""
+        names = self._getOrganizerNames(confs)
+        seats_left = seats.getSeatsAvailable(confs)
+        forms = [self._copyConferenceToForm(conf, names[conf.key.parent()])
+                 for conf in confs]
+        for conf, cf in zip(confs, forms):
+            cf.seatsAvailable = seats_left[conf.key]
+        return forms
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -155,6 +313,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -186,22 +346,55 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
+        # split the seats into shards for concurrent registrations
+        data['seatShards'] = seats.shardCount(data['maxAttendees'])
+
         # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        conf = Conference(**data)
+        ndb.put_multi([conf] + seats.makeShards(
+            c_key, data['seatsAvailable'], data['seatShards']))
+        catalog.invalidate()
+        facets.recordChange(facets.countDeltas(
+            facets.facetValues(None), facets.facetValues(conf)))
+        search.scheduleIndex([c_key])
+        notifications.queueMail('conference', user.email(), conf)
 
         return request
 
-    @ndb.transactional()
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
+        # the seats of a sharded conference are out of reach of the
+        # conference transaction, sum them before
+        seats_left = None
+        if request.maxAttendees is not None:
+            conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+            if conf and conf.seatShards:
+                seats_left = seats.sumShards(conf)
+
+        conf, seat_delta, old_facets = self._updateConferenceTxn(
+            request, user_id, seats_left)
+        facets.recordChange(facets.countDeltas(old_facets, facets.facetValues(conf)))
+        search.scheduleIndex([conf.key])
+        # seats of sharded conferences follow maxAttendees once committed
+        if seat_delta and conf.seatShards:
+            conf.maxAttendees += seats.adjustSeats(conf.key, seat_delta)
+        # seats or name may have changed
+        self._updateNearlySoldOut(conf, seats.getSeatsAvailable([conf])[conf.key])
+        return self._copyConferencesToForms([conf])[0]
+
+
+    @ndb.transactional()
+    def _updateConferenceTxn(self, request, user_id, seats_left=None):
+        """Update conference with the provided fields of request; return it
+        with the change of its maxAttendees and its former facet values.
+
+        maxAttendees cannot go below the seats taken; seats_left are the
+        seats available of a sharded conference.
+        """
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
@@ -218,8 +411,13 @@ class ConferenceApi(remote.Service):
                 'Only the owner can update the conference.')
 
         # Not getting all the fields, so don't create a new object; just
-        # copy relevant fields from ConferenceForm to Conference object
+        # copy relevant fields from ConferenceForm to Conference object;
+        # seatsAvailable follows maxAttendees and registrations only
+        old_max = conf.maxAttendees or 0
+        old_facets = facets.facetValues(conf)
         for field in request.all_fields():
+            if field.name in ('seatsAvailable', 'etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -230,9 +428,20 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        seat_delta = (conf.maxAttendees or 0) - old_max
+        if seat_delta < 0:
+            if not conf.seatShards or seats_left is None:
+                seats_left = conf.seatsAvailable or 0
+            taken = old_max - seats_left
+            if conf.maxAttendees < taken:
+                raise endpoints.BadRequestException(
+                    'maxAttendees cannot be lower than the %d seats taken.' % taken)
+        if seat_delta and not conf.seatShards:
+            conf.seatsAvailable = max(0, (conf.seatsAvailable or 0) + seat_delta)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cache.invalidateEntities([conf.key])
+        catalog.invalidate()
+        return conf, seat_delta, old_facets
 
 
     @endpoints.method(ConferenceForm, ConferenceForm,
@@ -252,19 +461,43 @@ class ConferenceApi(remote.Service):
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @staticmethod
+    def _checkEtag(request, etag):
+        """Return whether the client sent etag back in ifNoneMatch, i.e.
+        already has the current payload.
+
+        ETags from cache.getEtag() are taken before the payload is read,
+        so a write in between only makes the client fetch once more.
+        """
+        matched = request.ifNoneMatch == etag
+        cache.recordStats(cache.ETAG_CACHE, int(matched), int(not matched))
+        return matched
+
+
+    @endpoints.method(CONF_CONDITIONAL_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
+        """Return requested conference (by websafeConferenceKey), or only
+        notModified when ifNoneMatch is its current etag."""
+        wsck = request.websafeConferenceKey
+        conf_key = ndb.Key(urlsafe=wsck)
+        # the organizer name and the seats left are part of the form
+        names = [wsck, seats.SEATS_PREFIX + wsck]
+        if conf_key.parent():
+            names.append(conf_key.parent().urlsafe())
+        etag = cache.getEtag(names)
+        if self._checkEtag(request, etag):
+            return ConferenceForm(etag=etag, notModified=True)
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = cache.getEntity(conf_key)
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+                'No conference found with key: %s' % wsck)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferencesToForms([conf])[0]
+        cf.etag = etag
+        return cf
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -280,14 +513,9 @@ class ConferenceApi(remote.Service):
         # make profile key
         p_key = ndb.Key(Profile, getUserId(user))
         # create ancestor query for this user
-        conferences = Conference.query(ancestor=p_key)
-        # get the user profile and display name
-        prof = p_key.get()
-        displayName = getattr(prof, 'displayName')
+        conferences = Conference.query(ancestor=p_key).fetch()
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, displayName) for conf in conferences]
-        )
+        return ConferenceForms(items=self._copyConferencesToForms(conferences))
 
     ######################################
     # Filter Conference
@@ -318,34 +546,62 @@ class ConferenceApi(remote.Service):
         q = q.order(Conference.name)
         q = q.filter(Conference.month == 12)
 
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
-        )
+        return ConferenceForms(items=self._copyConferencesToForms(q.fetch()))
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _planQuery(self, filters):
+        """Choose the filters run by the datastore.
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        The datastore runs the most selective equality filter or, without
+        one, the inequality filters of a single field, so that every plan
+        is served by a (field, name) index of index.yaml; "!=" filters and
+        the other filters are evaluated in memory.
+        """
+        q = Conference.query()
+        candidates = [f for f in filters if f["operator"] != "!="]
+        pushed = []
+        if candidates:
+            best = max(candidates, key=lambda f: (
+                f["operator"] == "=", FILTER_SELECTIVITY[f["field"]]))
+            if best["operator"] == "=":
+                pushed = [best]
+            else:
+                pushed = [f for f in candidates
+                          if f["field"] == best["field"] and f["operator"] != "="]
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
+        for filtr in pushed:
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
-        return q
+
+        # If exists, sort on inequality filter first
+        if pushed and pushed[0]["operator"] != "=":
+            q = q.order(ndb.GenericProperty(pushed[0]["field"]))
+        q = q.order(Conference.name)
+
+        residual = [f for f in filters if not any(f is p for p in pushed)]
+        plan = 'datastore: %s; in memory: %s' % (
+            ', '.join(self._describeFilter(f) for f in pushed) or 'all',
+            ', '.join(self._describeFilter(f) for f in residual) or 'none')
+        return q, residual, plan
+
+
+    def _describeFilter(self, filtr):
+        """Return filter as text, e.g. city = London."""
+        return '%s %s %s' % (filtr["field"], filtr["operator"], filtr["value"])
+
+
+    def _matchesFilter(self, conf, filtr):
+        """Return if conf matches filter (any value of a repeated property)."""
+        values = getattr(conf, filtr["field"])
+        if not isinstance(values, list):
+            values = [values]
+        compare = COMPARATORS[filtr["operator"]]
+        return any(value is not None and compare(value, filtr["value"])
+                   for value in values)
 
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -356,34 +612,152 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter value of %s must be a number." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                 path='queryConferences',
                 http_method='POST',
                 name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        filters = self._formatFilters(request.filters)
+        # datastore cursors continue on the datastore
+        if not request.cursor or catalog.isCursor(request.cursor):
+            snapshot = catalog.getSnapshot()
+            snapshot_filters = [(f["field"], f["operator"], COMPARATORS[f["operator"]], f["value"])
+                                for f in filters]
+            page_size = self._pageSize(request.pageSize)
+            try:
+                if snapshot:
+                    keys, next_cursor = snapshot.query(
+                        snapshot_filters, page_size, request.cursor)
+                    plan = 'snapshot'
+                elif request.cursor:
+                    # snapshot cursor on an instance without snapshot
+                    keys, next_cursor = catalog.scan(
+                        snapshot_filters, page_size, request.cursor, QUERY_SCAN_LIMIT)
+                    plan = 'scan from snapshot cursor'
+                else:
+                    keys = None
+            except ValueError:
+                raise endpoints.BadRequestException("Invalid cursor: %s" % request.cursor)
+            if keys is not None:
+                conferences = [conf for conf in cache.getEntities(keys) if conf]
+                plan = '%s: %s' % (plan, ', '.join(
+                    self._describeFilter(f) for f in filters) or 'all')
+                return ConferenceForms(
+                    items=self._copyConferencesToForms(conferences),
+                    nextCursor=next_cursor,
+                    queryPlan=plan
+                )
+
+        query, residual, plan = self._planQuery(filters)
+        if residual:
+            conferences, next_cursor, scanned = self._fetchFilteredPage(
+                query, residual, request.pageSize, request.cursor)
+            plan = '%s; scanned %d' % (plan, scanned)
+        else:
+            conferences, next_cursor = self._fetchPage(
+                query, request.pageSize, request.cursor)
 
          # return individual ConferenceForm object per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") \
-            for conf in conferences]
+            items=self._copyConferencesToForms(conferences),
+            nextCursor=next_cursor,
+            queryPlan=plan
         )
 
 
+    def _pageSize(self, page_size):
+        """Return requested page size, defaulted and capped."""
+        if not page_size or page_size < 1:
+            page_size = DEFAULT_PAGE_SIZE
+        return min(page_size, MAX_PAGE_SIZE)
+
+
+    def _startCursor(self, cursor):
+        """Return Cursor from its urlsafe form (None for the first page)."""
+        try:
+            return Cursor(urlsafe=cursor) if cursor else None
+        except Exception:
+            raise endpoints.BadRequestException("Invalid cursor: %s" % cursor)
+
+
+    def _fetchPage(self, query, page_size, cursor, **options):
+        """Fetch one page of query results starting at the urlsafe cursor.
+
+        Returns the entities (or keys with keys_only=True in options) and
+        the urlsafe cursor of the next page (None when there are no more
+        results).
+        """
+        items, next_cursor, more = query.fetch_page(
+            self._pageSize(page_size), start_cursor=self._startCursor(cursor), **options)
+        if more and next_cursor:
+            return items, next_cursor.urlsafe()
+        return items, None
+
+
+    def _fetchFilteredPage(self, query, residual, page_size, cursor):
+        """Fetch one page of the query results matching the residual filters.
+
+        Results are streamed in batches and at most QUERY_SCAN_LIMIT of
+        them are examined per request, so a page may come back short (even
+        empty) with a cursor to continue from. Returns the entities, the
+        urlsafe cursor of the next page and the number of entities examined.
+        """
+        page_size = self._pageSize(page_size)
+        it = query.iter(start_cursor=self._startCursor(cursor),
+                        batch_size=QUERY_BATCH_SIZE, produce_cursors=True)
+        items = []
+        scanned = 0
+        while len(items) < page_size and scanned < QUERY_SCAN_LIMIT and it.has_next():
+            entity = it.next()
+            scanned += 1
+            if all(self._matchesFilter(entity, f) for f in residual):
+                items.append(entity)
+        if scanned and it.probably_has_next():
+            return items, it.cursor_after().urlsafe(), scanned
+        return items, None, scanned
+
+
+    @endpoints.method(message_types.VoidMessage, FacetForms,
+                path='facets',
+                http_method='GET',
+                name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the number of conferences per city, topic and month."""
+        return FacetForms(items=[
+            FacetForm(field=field, value=value, count=count)
+            for field, counts in sorted(facets.getFacets().items())
+            for value, count in sorted(counts.items())])
+
+
+    @endpoints.method(SEARCH_GET_REQUEST, SearchResultForms,
+                path='search',
+                http_method='GET',
+                name='fullTextSearch')
+    def fullTextSearch(self, request):
+        """Search conferences and sessions by the words of their names,
+        descriptions, topics and highlights, best matches first within a
+        page; pages follow the score of the longest word."""
+        results, next_cursor = search.search(
+            request.query, self._pageSize(request.pageSize),
+            self._startCursor(request.cursor))
+        return SearchResultForms(
+            items=[SearchResultForm(kind=doc.kind, websafeKey=doc.key.id(),
+                                    title=doc.title, score=score)
+                   for doc, score in results],
+            nextCursor=next_cursor.urlsafe() if next_cursor else None)
+
+
     ######################################
     # Profile
     ######################################
@@ -404,23 +778,82 @@ class ConferenceApi(remote.Service):
 
 
     def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
+        """Return user Profile, creating new one if non-existent.
+
+        The profile is memoized for the request and kept in memcache for
+        PROFILE_TTL seconds; profile writes call _invalidateProfile().
+        """
+        memo = self._requestCache('profile')
+        if 'profile' in memo:
+            cache.recordStats(PROFILE_CACHE, 1, 0)
+            return memo['profile']
+
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
+        profile = memcache.get(MEMCACHE_PROFILE_PREFIX + user_id)
+        cache.recordStats(PROFILE_CACHE, int(profile is not None), int(profile is None))
+        if profile is None:
+            profile = p_key.get()
+            if not profile:
+                profile = Profile(
+                    key = p_key,
+                    displayName = user.nickname(),
+                    mainEmail = user.email(),
+                    teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
+                )
+                profile.put()
+            elif profile.conferenceKeysToAttend or profile.sessionsWishlist:
+                profile = self._migrateProfile(p_key)
+            memcache.add(MEMCACHE_PROFILE_PREFIX + user_id, profile, time=PROFILE_TTL)
+
+        memo['profile'] = profile
+        return profile      # return Profile
+
+
+    @staticmethod
+    def _invalidateProfile(p_key):
+        """Drop the memcache copy of the profile after a write and move
+        its version (the ETags of its conferences carry its name)."""
+        memcache.delete(MEMCACHE_PROFILE_PREFIX + p_key.id())
+        cache.invalidateEntities([p_key])
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateProfile(p_key):
+        """Move the conferenceKeysToAttend and sessionsWishlist of a profile
+        into Registrations and WishlistEntries. Every legacy session is
+        kept, MAX_WISHLIST_SESSIONS only limits the sessions added later."""
         profile = p_key.get()
-        if not profile:
-            profile = Profile(
-                key = p_key,
-                displayName = user.nickname(),
-                mainEmail = user.email(),
-                teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
-            )
-            profile.put()
+        registrations = [
+            Registration(parent=p_key, id=wsck, conference=ndb.Key(urlsafe=wsck))
+            for wsck in profile.conferenceKeysToAttend]
+        entries = [
+            WishlistEntry(parent=p_key, id=s_key.urlsafe(), session=s_key)
+            for s_key in profile.sessionsWishlist]
+        del profile.conferenceKeysToAttend[:]
+        del profile.sessionsWishlist[:]
+        ndb.put_multi([profile] + registrations + entries)
+        cache.invalidateCollections('WishlistEntry', [p_key])
+        return profile
 
-        return profile      # return Profile
+
+    @staticmethod
+    def _migrateProfilesPage(cursor=None, batch_size=MIGRATE_BATCH_SIZE):
+        """Migrate the legacy lists of one page of profiles, so that
+        getConferenceAttendees lists the users who did not come back;
+        return the urlsafe cursor of the next page (None after the last one).
+        """
+        profiles, next_cursor, more = Profile.query().fetch_page(
+            batch_size, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        for profile in profiles:
+            if profile.conferenceKeysToAttend or profile.sessionsWishlist:
+                ConferenceApi._migrateProfile(profile.key)
+                ConferenceApi._invalidateProfile(profile.key)
+        return next_cursor.urlsafe() if more and next_cursor else None
 
 
     def _doProfile(self, save_request=None):
@@ -436,6 +869,7 @@ class ConferenceApi(remote.Service):
                     if val:
                         setattr(prof, field, str(val))
             prof.put()
+            self._invalidateProfile(prof.key)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -462,76 +896,152 @@ class ConferenceApi(remote.Service):
     # Registration
     ######################################
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
         prof = self._getProfileFromUser() # get user Profile
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = cache.getEntity(ndb.Key(urlsafe=wsck))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
-        # register
-        if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
+        retval = self._registerProfile(prof.key, conf, reg)
+        if retval and reg and prof.mainEmail:
+            notifications.queueMail('registration', prof.mainEmail, conf)
+        return BooleanMessage(data=retval)
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+    @staticmethod
+    def _registerProfile(p_key, conf, reg=True):
+        """Register or unregister the profile for conf; return if changed.
 
-        # unregister
-        else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+        The registration is a Registration child of the profile and the
+        seat is taken from (or given back to) a single seat shard, so the
+        transaction spans the profile entity group and that shard only.
+        """
+        wsck = conf.key.urlsafe()
+        reg_key = ndb.Key(Registration, wsck, parent=p_key)
+        shard_keys = seats.ensureShards(conf)
+
+        @ndb.transactional(xg=True)
+        def txn(shard_key):
+            registration = reg_key.get()
+            # register
+            if reg:
+                # check if user already registered otherwise add
+                if registration:
+                    raise ConflictException(
+                        "You have already registered for this conference")
+
+                # check if seats avail
+                if shard_key is None:
+                    raise ConflictException(
+                        "There are no seats available.")
+                shard = shard_key.get()
+                if shard.seatsAvailable <= 0:
+                    raise seats.ShardExhausted()
+
+                # register user, take away one seat
+                shard.seatsAvailable -= 1
+                ndb.put_multi([
+                    Registration(key=reg_key, conference=conf.key), shard])
+
+            # unregister
+            else:
+                # check if user already registered
+                if not registration:
+                    return False
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+                shard = shard_key.get()
+                shard.seatsAvailable += 1
+                reg_key.delete()
+                shard.put()
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+            return True
 
+        # a shard may run out of seats between picking and registering,
+        # then pick again among the shards that still have seats
+        for attempt in range(len(shard_keys) + 1):
+            try:
+                retval = txn(seats.pickShard(shard_keys, reg))
+                break
+            except seats.ShardExhausted:
+                continue
+        else:
+            raise ConflictException("There are no seats available.")
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+        if retval:
+            seats_left = seats.recordChange(conf.key, -1 if reg else 1)
+            if seats_left is None:
+                seats_left = seats.getSeatsAvailable([conf])[conf.key]
+            ConferenceApi._updateNearlySoldOut(conf, seats_left)
+        return retval
+
+
+    @endpoints.method(CONF_PAGE_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
-        """Get list of conferences that user has registered for."""
+        """Get list of conferences that user has registered for, one page at a time."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        reg_keys, next_cursor = self._fetchPage(
+            Registration.query(ancestor=prof.key),
+            request.pageSize, request.cursor, keys_only=True)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # each conference get is followed by its organizer get as soon as
+        # it arrives; ndb batches the concurrent gets into few RPCs
+        futures = [self._getConferenceWithOrganizerAsync(ndb.Key(urlsafe=reg_key.id()))
+                   for reg_key in reg_keys]
+        # drop the conferences that no longer exist
+        conferences = [conf for conf in (f.get_result() for f in futures) if conf]
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+        return ConferenceForms(
+            items=self._copyConferencesToForms(conferences),
+            nextCursor=next_cursor
+        )
+
+
+    @ndb.tasklet
+    def _getConferenceWithOrganizerAsync(self, conf_key):
+        """Get conference, then its organizer name into the request name
+        cache; the future result is None when the conference is gone."""
+        conf = yield conf_key.get_async()
+        if conf:
+            names = self._requestCache('organizerNames')
+            p_key = conf_key.parent()
+            if p_key not in names:
+                prof = yield p_key.get_async()
+                names[p_key] = getattr(prof, 'displayName', None) or ""
+        raise ndb.Return(conf)
+
+
+    @endpoints.method(CONF_ATTENDEES_GET_REQUEST, ProfileForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return the profiles registered for a conference, one page at a time (organizer only)."""
+        prof = self._getProfileFromUser() # get user Profile
+        conf = cache.getEntity(ndb.Key(urlsafe=request.websafeConferenceKey))
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if conf.key.parent() != prof.key:
+            raise endpoints.ForbiddenException(
+                'Only the owner can list the attendees.')
+
+        reg_keys, next_cursor = self._fetchPage(
+            Registration.query(Registration.conference == conf.key),
+            request.pageSize, request.cursor, keys_only=True)
+        profiles = ndb.get_multi([reg_key.parent() for reg_key in reg_keys])
+
+        return ProfileForms(
+            items=[self._copyProfileToForm(p) for p in profiles if p],
+            nextCursor=next_cursor
         )
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -554,41 +1064,111 @@ class ConferenceApi(remote.Service):
     ######################################
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
+    def _setAnnouncement(conferences, rebuild=False):
+        """Format Announcement from the nearly sold out conferences
+        (websafe key -> name) & assign both to memcache; only add them
+        when rebuilding evicted or dropped copies."""
+        if conferences:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
+            # format announcement
             announcement = '%s %s' % (
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+                ', '.join(sorted(conferences.values())))
         else:
             # If there are no sold out conferences,
-            # delete the memcache announcements entry
+            # cache the empty announcement
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
+        mapping = {
+            MEMCACHE_NEARLY_SOLD_OUT_KEY: conferences,
+            MEMCACHE_ANNOUNCEMENTS_KEY: announcement,
+        }
+        if rebuild:
+            # fails while the copies of a newer update are delete locked
+            memcache.add_multi(mapping)
+            return announcement
+        changed = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) != announcement
+        memcache.set_multi(mapping)
+        # after the write, so no reader caches the old text under the new etag
+        if changed:
+            cache.bumpVersions([ANNOUNCEMENT_VERSION])
         return announcement
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @staticmethod
+    def _updateNearlySoldOut(conf, seats_left):
+        """Add conf to (or remove it from) the nearly sold out conferences
+        when its seats_left crossed the threshold, updating Announcement
+        and dropping its memcache copies. Nothing is written while the
+        conference stays on the same side."""
+        wsck = conf.key.urlsafe()
+        nearly = 0 < seats_left <= NEARLY_SOLD_OUT_SEATS
+        conferences = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        if conferences is None:
+            ann = NEARLY_SOLD_OUT_KEY.get()
+            conferences = ann and ann.conferences or {}
+        if conferences.get(wsck) == (conf.name if nearly else None):
+            return
+
+        @ndb.transactional()
+        def txn():
+            ann = NEARLY_SOLD_OUT_KEY.get() or Announcement(key=NEARLY_SOLD_OUT_KEY)
+            ann.conferences = ann.conferences or {}
+            if nearly:
+                ann.conferences[wsck] = conf.name
+            else:
+                ann.conferences.pop(wsck, None)
+            ann.put()
+
+        txn()
+        # concurrent updates may finish in any order, so drop the copies
+        # and let getAnnouncement rebuild them from the committed entity;
+        # the delete lock keeps out the copies of reads made before
+        memcache.delete_multi([MEMCACHE_NEARLY_SOLD_OUT_KEY, MEMCACHE_ANNOUNCEMENTS_KEY],
+                              seconds=ANNOUNCEMENT_DELETE_LOCK)
+        cache.bumpVersions([ANNOUNCEMENT_VERSION])
+
+
+    @staticmethod
+    def _cacheAnnouncement():
+        """Reconcile the nearly sold out conferences & assign Announcement
+        to memcache; used by memcache cron job & putAnnouncement().
+        Registrations keep them up to date in between.
+        """
+        confs = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch()
+
+        ann = NEARLY_SOLD_OUT_KEY.get() or Announcement(key=NEARLY_SOLD_OUT_KEY)
+        # Conference.seatsAvailable lags behind the seat shards, check
+        # the candidates and the current members against the shards
+        known = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in (ann.conferences or {})])
+        candidates = dict((conf.key, conf) for conf in confs + known if conf)
+        seats_left = seats.getSeatsAvailable(candidates.values())
+        ann.conferences = dict(
+            (conf.key.urlsafe(), conf.name) for key, conf in candidates.items()
+            if 0 < seats_left[key] <= NEARLY_SOLD_OUT_SEATS)
+        ann.put()
+
+        return ConferenceApi._setAnnouncement(ann.conferences)
+
+
+    @endpoints.method(ANNOUNCEMENT_GET_REQUEST, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
+        """Return Announcement from memcache, or from its datastore backing if evicted;
+        only notModified when ifNoneMatch is its current etag."""
+        etag = cache.getEtag([ANNOUNCEMENT_VERSION])
+        if self._checkEtag(request, etag):
+            return StringMessage(data='', etag=etag, notModified=True)
         announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
-        return StringMessage(data=announcement)
+        if announcement is None:
+            ann = NEARLY_SOLD_OUT_KEY.get()
+            announcement = self._setAnnouncement(ann and ann.conferences or {},
+                                                 rebuild=True)
+        return StringMessage(data=announcement, etag=etag)
 
     ######################################
     # Sessions
@@ -597,36 +1177,39 @@ class ConferenceApi(remote.Service):
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
         sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                # convert Date/Time/Speaker to date/time/speaker string; just copy others
-                if field.name == "date" or field.name == "startTime" or field.name == "speaker":
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                elif field.name == 'typeOfSession':
-                    setattr(sf, field.name, getattr(SessionTypes, str(getattr(sess, field.name))))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, sess.key.urlsafe())
-
-        sf.check_initialized()
+        # convert Date/Time/Speaker to date/time/speaker string,
+        # type string to SessionTypes; just copy others
+        for name, convert in SESSION_FORM_PLAN:
+            value = getattr(sess, name)
+            setattr(sf, name, convert(value) if convert else value)
+        sf.websafeKey = sess.key.urlsafe()
+        # SessionForm has no required field, no need to check_initialized()
         return sf
 
 
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    def _copySessionsToForms(self, sessions):
+        """Copy Sessions to SessionForms."""
+        return [self._copySessionToForm(sess) for sess in sessions]
+
+
+    @endpoints.method(CONF_CONDITIONAL_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/session',
             http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
-        """Given a conference (by websafeConferenceKey), return all sessions."""
+        """Given a conference (by websafeConferenceKey), return all sessions,
+        or only notModified when ifNoneMatch is their current etag."""
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        etag = cache.getEtag([cache.collectionName('Session', conf_key)])
+        if self._checkEtag(request, etag):
+            return SessionForms(etag=etag, notModified=True)
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = cache.getEntity(conf_key)
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        conf_key = conf.key
         sessions = Session.query(ancestor=conf_key)
 
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        return SessionForms(items=self._copySessionsToForms(sessions.fetch()), etag=etag)
 
 
     @endpoints.method(SESSION_TYPE_GET_REQUEST, SessionForms,
@@ -635,100 +1218,144 @@ class ConferenceApi(remote.Service):
     def getConferenceSessionsByType(self, request):
         """Given a conference (by websafeConferenceKey) and session type, return all sessions."""
         # get Conference object from request; bail if not found
-        confKey = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not confKey:
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        if not cache.getEntity(conf_key):
             raise endpoints.NotFoundException('No conference found with key: %s' % request.websafeConferenceKey)
         if request.sessionType not in SessionTypes:
             raise endpoints.NotFoundException('There is no such session type: %s' % request.sessionType)
-        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
         sessions = Session.query(ancestor=conf_key)
         sessions = sessions.filter(Session.typeOfSession == request.sessionType)
 
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        return SessionForms(items=self._copySessionsToForms(sessions.fetch()))
 
     @endpoints.method(SESSION_SPEAKER_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessions/speaker/{speaker}',
             http_method='GET', name='getConferenceSessionsBySpeaker')
     def getConferenceSessionsBySpeaker(self, request):
         """Given speaker, return all sessions."""
-        speaker = ndb.Key(urlsafe=request.speaker).get()
+        speaker = cache.getEntity(ndb.Key(urlsafe=request.speaker))
         if not speaker:
             raise endpoints.NotFoundException(
                 'No speaker found with key: %s' % request.speaker)
         sessions = Session.query(ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
-        sessions = sessions.filter(Session.speaker == ndb.Key(urlsafe=request.speaker))
+        sessions = sessions.filter(Session.speaker == speaker.key)
 
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        return SessionForms(items=self._copySessionsToForms(sessions.fetch()))
 
     def _createSessionObject(self, request):
         """Create Session object, returning SessionForm/request."""
+        return self._createSessionObjects(request.websafeConferenceKey, [request])[0]
+
+
+    def _createSessionObjects(self, wsck, forms):
+        """Create Session objects for the conference, returning SessionForms.
+
+        The conference and the distinct speakers are resolved once, the
+        session IDs are allocated in a single range, the sessions are put
+        together and one featured speaker task is enqueued per speaker.
+        """
         # preload necessary data items
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        if len(forms) > MAX_SESSIONS_PER_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d sessions can be created at once' % MAX_SESSIONS_PER_BATCH)
+        for form in forms:
+            if not form.sessionName:
+                raise endpoints.BadRequestException(
+                    "Session 'sessionName' field required")
+            if not form.speaker:
+                raise endpoints.BadRequestException(
+                    "Session 'speaker' field required")
+
+        # resolve conference & distinct speakers in one round trip
+        conf_key = ndb.Key(urlsafe=wsck)
+        speaker_keys = list(set(ndb.Key(urlsafe=form.speaker) for form in forms))
+        entities = cache.getEntities([conf_key] + speaker_keys)
+        conf = entities[0]
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % wsck)
 
-        speaker = ndb.Key(urlsafe=request.speaker).get()
-        if not speaker:
-            raise endpoints.NotFoundException(
-                'No speaker found with key: %s' % request.speaker)
+        for speaker_key, speaker in zip(speaker_keys, entities[1:]):
+            if not speaker:
+                raise endpoints.NotFoundException(
+                    'No speaker found with key: %s' % speaker_key.urlsafe())
 
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
-        if not request.sessionName:
-            raise endpoints.BadRequestException(
-                "Session 'sessionName' field required")
+        if not forms:
+            return []
+
+        # Create Session keys from a single ID range
+        first_id, last_id = Session.allocate_ids(size=len(forms), parent=conf_key)
+        sessions = [self._sessionFromForm(form, ndb.Key(Session, first_id + i, parent=conf_key))
+                    for i, form in enumerate(forms)]
+        # Put sessions into datastore
+        ndb.put_multi(sessions)
+        cache.invalidateEntities([sess.key for sess in sessions])
+        cache.invalidateCollections('Session', [conf_key])
+        search.scheduleIndex([sess.key for sess in sessions])
+
+        self._enqueueFeaturedSpeakers(conf_key, sessions)
+        return [self._copySessionToForm(sess) for sess in sessions]
 
+
+    def _sessionFromForm(self, form, session_key):
+        """Return Session (not put yet) with session_key from SessionForm."""
         # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        data = {field.name: getattr(form, field.name) for field in form.all_fields()}
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS_SESSION:
             if data[df] in (None, []):
                 if df == "typeOfSession":
                     data[df] = SessionTypes.LECTURE
-                    setattr(request, df, SessionTypes.LECTURE)
+                    setattr(form, df, SessionTypes.LECTURE)
                 else:
                     data[df] = DEFAULTS_SESSION[df]
-                    setattr(request, df, DEFAULTS_SESSION[df])
+                    setattr(form, df, DEFAULTS_SESSION[df])
 
-        # convert dates from strings to Date objects; set month based on start_date
+        # convert date/time from strings to Date/Time objects
         if data['date']:
             data['date'] = datetime.datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-        if data['date']:
+        if data['startTime']:
             data['startTime'] = datetime.datetime.strptime(data['startTime'], '%H:%M').time()
         if data['typeOfSession']:
             data['typeOfSession'] = str(data['typeOfSession'])
-        del data['websafeKey']
-        del data['websafeConferenceKey']
+        data.pop('websafeKey', None)
+        data.pop('websafeConferenceKey', None)
 
-        # Create Session key
-        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        new_session_id = Session.allocate_ids(size=1, parent=conf_key)[0]
-        session_key = ndb.Key(Session, new_session_id, parent=conf_key)
         data['key'] = session_key
-        # Get Speaker key
-        speaker_key = speaker.key
-        data['speaker'] = speaker_key
-        # Put session into datastore
-        Session(**data).put()
-        # Add created session to speakers sessions
-        #speaker.speakersSessions.append(session_key)
-        speaker.put()
+        data['speaker'] = ndb.Key(urlsafe=form.speaker)
+        return Session(**data)
 
-        taskqueue.add(params={'speaker_key': request.speaker,
-                              'conf_key': request.websafeConferenceKey
-                              },
-                      url='/tasks/set_featured_speaker',
-                      method='GET'
-                     )
-        return self._copySessionToForm(request)
+
+    @staticmethod
+    def _enqueueFeaturedSpeakers(conf_key, sessions):
+        """Enqueue one featured speaker task per speaker of the new sessions
+        of the conference; also used by the bulk import."""
+        by_speaker = {}
+        for sess in sessions:
+            by_speaker.setdefault(sess.speaker, []).append(sess)
+        # POST: the session keys of a batch would overflow a task URL;
+        # the names are read by the task, they have no size limit
+        tasks = [taskqueue.Task(params={'speaker_key': speaker_key.urlsafe(),
+                                        'conf_key': conf_key.urlsafe(),
+                                        'session_key': [sess.key.urlsafe() for sess in speaker_sessions],
+                                        },
+                                url='/tasks/set_featured_speaker',
+                                method='POST'
+                               )
+                 for speaker_key, speaker_sessions in by_speaker.items()]
+        # the task queue takes at most 100 tasks per call
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
 
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
@@ -739,62 +1366,114 @@ class ConferenceApi(remote.Service):
         """ Create a new Session"""
         return self._createSessionObject(request)
 
+
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms,
+        path='conference/{websafeConferenceKey}/sessions',
+        http_method='POST',
+        name='createSessions')
+    def createSessions(self, request):
+        """Create several Sessions of a conference at once."""
+        return SessionForms(items=self._createSessionObjects(
+            request.websafeConferenceKey, request.items))
+
     ######################################
     # Wishlist
     ######################################
 
     def _addToWishlist(self, request, add=True):
         """Add or delete session to user wishlist."""
-        retval = None
         prof = self._getProfileFromUser() # get user Profile
 
         # check if session exists given sessionKey
         # get sessions; check that it exists
         wssk = request.sessionKey
-        sess = ndb.Key(urlsafe=wssk).get()
+        sess = cache.getEntity(ndb.Key(urlsafe=wssk))
         if not sess:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % wssk)
 
-        # add
+        return BooleanMessage(data=self._updateWishlist(prof.key, sess.key, add))
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateWishlist(p_key, s_key, add=True):
+        """Add or delete the WishlistEntry of the session; return if the
+        wishlist changed. The Profile itself is not written."""
+        entry_key = ndb.Key(WishlistEntry, s_key.urlsafe(), parent=p_key)
+        entry = entry_key.get()
         if add:
             # check if user already added otherwise add
-            if sess.key in prof.sessionsWishlist:
+            if entry:
                 raise ConflictException(
                     "You have already added this session to wishlist")
-
-            # add session
-            prof.sessionsWishlist.append(sess.key)
-            retval = True
-
-        # delete
+            if WishlistEntry.query(ancestor=p_key).count(
+                    limit=MAX_WISHLIST_SESSIONS) >= MAX_WISHLIST_SESSIONS:
+                raise endpoints.BadRequestException(
+                    'A wishlist holds at most %d sessions' % MAX_WISHLIST_SESSIONS)
+            WishlistEntry(key=entry_key, session=s_key).put()
+        elif entry:
+            entry_key.delete()
         else:
-            # check if session in users wishlist
-            if sess.key in prof.sessionsWishlist:
+            return False
+        # new wishlist version for the cached agenda
+        cache.invalidateCollections('WishlistEntry', [p_key])
+        return True
 
-                # delete session from wishlist
-                prof.sessionsWishlist.remove(sess.key)
-                retval = True
-            else:
-                retval = False
 
-        # write things back to the datastore & return
-        prof.put()
-        #sess.put()
-        return BooleanMessage(data=retval)
+    def _getWishlistSessionKeys(self, entry_keys):
+        """Return the Session keys of WishlistEntry keys."""
+        return [ndb.Key(urlsafe=entry_key.id()) for entry_key in entry_keys]
 
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(CONF_PAGE_REQUEST, SessionForms,
             path='profile/wishlist',
             http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
-        """Get list of sessions that user has added to wishlist."""
+        """Get list of sessions that user has added to wishlist, one page
+        at a time."""
         prof = self._getProfileFromUser() # get user Profile
-        session_keys = prof.sessionsWishlist
-        sessions = ndb.get_multi(session_keys)
+        entry_keys, next_cursor = self._fetchPage(
+            WishlistEntry.query(ancestor=prof.key),
+            request.pageSize, request.cursor, keys_only=True)
+        # drop the sessions that no longer exist
+        sessions = [sess for sess in
+                    ndb.get_multi(self._getWishlistSessionKeys(entry_keys)) if sess]
 
         # return set of SessionForm objects per Session
-        return SessionForms(items=[self._copySessionToForm(sess) for sess in sessions])
+        return SessionForms(items=self._copySessionsToForms(sessions),
+                            nextCursor=next_cursor)
+
+    @endpoints.method(message_types.VoidMessage, AgendaForm,
+            path='profile/agenda',
+            http_method='GET', name='getAgenda')
+    def getAgenda(self, request):
+        """Get the wishlist as a conflict-free schedule, the groups of
+        overlapping sessions and the sessions without a time."""
+        prof = self._getProfileFromUser() # get user Profile
+        p_urlsafe = prof.key.urlsafe()
+        wishlist = cache.collectionName('WishlistEntry', prof.key)
+        version = cache.getVersions([wishlist])[wishlist]
+        cache_key = '%s%s:%d' % (MEMCACHE_AGENDA_PREFIX, p_urlsafe, version)
+        cached = memcache.get(cache_key)
+        cache.recordStats(AGENDA_CACHE, int(cached is not None), int(cached is None))
+        if cached is not None:
+            return protobuf.decode_message(AgendaForm, cached)
+
+        # one batched get; drop the sessions that no longer exist
+        entry_keys = WishlistEntry.query(ancestor=prof.key).fetch(keys_only=True)
+        sessions = [sess for sess in
+                    ndb.get_multi(self._getWishlistSessionKeys(entry_keys)) if sess]
+        schedule, conflicts, unscheduled = agenda.buildAgenda(sessions)
+        forms = dict(zip([sess.key for sess in sessions],
+                         self._copySessionsToForms(sessions)))
+        form = AgendaForm(
+            schedule=[forms[sess.key] for sess in schedule],
+            conflicts=[ConflictForm(items=[forms[sess.key] for sess in group])
+                       for group in conflicts],
+            unscheduled=[forms[sess.key] for sess in unscheduled])
+        memcache.set(cache_key, protobuf.encode_message(form))
+        return form
 
     @endpoints.method(SESSION_GET_REQUEST, BooleanMessage,
             path='profile/wishlist/{sessionKey}',
@@ -815,16 +1494,14 @@ class ConferenceApi(remote.Service):
     # Queries and indexes
     ######################################
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(CONF_PAGE_REQUEST, SessionForms,
                 path='sessions/long',
                 http_method='GET',
                 name='queryLongSessions')
     def queryLongSessions(self, request):
         """Query for sessions with duration more than 60."""
-        sessions = Session.query()
-        sessions = sessions.filter(Session.duration > 60)
-
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        return self._querySessions(min_duration=61, page_size=request.pageSize,
+                                   cursor=request.cursor)
 
     @endpoints.method(SESSION_GET_REQUEST, ConferenceForm,
             path='conference',
@@ -833,27 +1510,98 @@ class ConferenceApi(remote.Service):
     def getConferenceBySession(self, request):
         """Given a Session key, return appropriate Conference."""
         # get Session object from request; bail if not found
-        sess = ndb.Key(urlsafe=request.sessionKey).get()
+        sess_key = ndb.Key(urlsafe=request.sessionKey)
+        sess = cache.getEntity(sess_key)
         if not sess:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % request.sessionKey)
-        conf = sess.key.parent().get()
-        prof = conf.key.parent().get()
+        conf = cache.getEntity(sess_key.parent())
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferencesToForms([conf])[0]
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(CONF_PAGE_REQUEST, SessionForms,
                 path='sessions/before7pmNotWorkshops',
                 http_method='GET',
                 name='queryBefore7pmNotWorkshops')
     def queryBefore7pmNotWorkshops(self, request):
         """Query for sessions with type other than Workshop and start time before 19:00:00."""
-        sessions = Session.query()
-        sessions = sessions.order(Session.startTime)
-        sessions = sessions.filter(Session.typeOfSession.IN(["LECTURE", "KEYNOTE"]))
-        sessions = sessions.filter(Session.startTime < datetime.time(hour=19))
+        return self._querySessions(start_before=datetime.time(hour=19),
+                                   exclude_types=['WORKSHOP'],
+                                   page_size=request.pageSize, cursor=request.cursor)
 
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+    @endpoints.method(SESSION_QUERY_REQUEST, SessionForms,
+                path='sessions/query',
+                http_method='GET',
+                name='querySessions')
+    def querySessions(self, request):
+        """Query sessions of all conferences by duration (minutes,
+        inclusive), start time window (HH:MM, startBefore exclusive),
+        excluded types and date, one page at a time."""
+        try:
+            start_after, start_before = [
+                datetime.datetime.strptime(t, '%H:%M').time() if t else None
+                for t in (request.startAfter, request.startBefore)]
+            date = (datetime.datetime.strptime(request.date[:10], '%Y-%m-%d').date()
+                    if request.date else None)
+        except ValueError:
+            raise endpoints.BadRequestException(
+                'Times must be HH:MM and dates YYYY-MM-DD.')
+        return self._querySessions(
+            min_duration=request.minDuration, max_duration=request.maxDuration,
+            start_after=start_after, start_before=start_before,
+            exclude_types=request.excludeTypes, date=date,
+            page_size=request.pageSize, cursor=request.cursor)
+
+    def _querySessions(self, min_duration=None, max_duration=None,
+                       start_after=None, start_before=None, exclude_types=(),
+                       date=None, page_size=None, cursor=None):
+        """Return one page of the sessions of all conferences matching the
+        criteria as SessionForms.
+
+        Types and date are equality filters (the types through the
+        precomputed Session.typeSets), so the datastore runs one range
+        over the startTime or duration index; a duration range combined
+        with a time window is evaluated in memory with a bounded scan.
+        Both bounds of a range are always set, which leaves out the
+        sessions without a start time or duration.
+        """
+        unknown = [t for t in exclude_types if t not in SESSION_TYPES]
+        if unknown:
+            raise endpoints.BadRequestException(
+                'Invalid session types: %s' % ', '.join(unknown))
+        included = sorted(set(SESSION_TYPES) - set(exclude_types))
+        if not included:
+            return SessionForms(items=[])
+
+        q = Session.query()
+        if exclude_types:
+            q = q.filter(Session.typeSets == ','.join(included))
+        if date:
+            q = q.filter(Session.date == date)
+
+        residual = []
+        if start_after or start_before:
+            q = q.filter(Session.startTime >= (start_after or datetime.time(0)))
+            if start_before:
+                q = q.filter(Session.startTime < start_before)
+            q = q.order(Session.startTime)
+            if min_duration is not None:
+                residual.append({'field': 'duration', 'operator': '>=', 'value': min_duration})
+            if max_duration is not None:
+                residual.append({'field': 'duration', 'operator': '<=', 'value': max_duration})
+        elif min_duration is not None or max_duration is not None:
+            q = q.filter(Session.duration >= (min_duration or 0))
+            if max_duration is not None:
+                q = q.filter(Session.duration <= max_duration)
+            q = q.order(Session.duration)
+
+        if residual:
+            sessions, next_cursor, scanned = self._fetchFilteredPage(
+                q, residual, page_size, cursor)
+        else:
+            sessions, next_cursor = self._fetchPage(q, page_size, cursor)
+        return SessionForms(items=self._copySessionsToForms(sessions),
+                            nextCursor=next_cursor)
 
     ######################################
     # Speaker
@@ -876,12 +1624,18 @@ class ConferenceApi(remote.Service):
                 http_method='GET',
                 name='getSpeaker')
     def getSpeaker(self, request):
-        """Return speaker profile by key."""
-        speaker = ndb.Key(urlsafe=request.speakerKey).get()
+        """Return speaker profile by key, or only notModified when
+        ifNoneMatch is its current etag."""
+        etag = cache.getEtag([request.speakerKey])
+        if self._checkEtag(request, etag):
+            return SpeakerForm(etag=etag, notModified=True)
+        speaker = cache.getEntity(ndb.Key(urlsafe=request.speakerKey))
         if not speaker:
             raise endpoints.NotFoundException(
                 'No speaker found with key: %s' % request.speakerKey)
-        return self._copySpeakerProfileToForm(speaker)
+        sf = self._copySpeakerProfileToForm(speaker)
+        sf.etag = etag
+        return sf
 
     @endpoints.method(SpeakerForm, SpeakerForm,
                 path='speaker',
@@ -894,6 +1648,22 @@ class ConferenceApi(remote.Service):
         speaker.put()
         return self._copySpeakerProfileToForm(speaker)
 
+    ######################################
+    # Cache
+    ######################################
+
+    @endpoints.method(message_types.VoidMessage, CacheStatsForms,
+                path='cache/stats',
+                http_method='GET',
+                name='getCacheStats')
+    def getCacheStats(self, request):
+        """Return hit and miss counters of the memcache layers."""
+        stats = cache.getStats([cache.ENTITY_CACHE,
+                                cache.ETAG_CACHE, AGENDA_CACHE, PROFILE_CACHE])
+        return CacheStatsForms(items=[
+            CacheStatsForm(name=name, hits=hits, misses=misses)
+            for name, (hits, misses) in sorted(stats.items())])
+
 
 
     ######################################
@@ -901,42 +1671,79 @@ class ConferenceApi(remote.Service):
     ######################################
 
     @staticmethod
-    def _cacheFeaturedSpeaker(c_key, s_key):
+    def _cacheFeaturedSpeaker(c_key, s_key, session_keys=(), session_names=None):
         """
-        Set Featured Speaker (speaker with more than one session) to memcache; used by featured speaker task.
-        If there is no Featured Speaker clear memcache.
+        Add the new sessions of a speaker to the speaker sessions kept in memcache for the
+        conference, and set the speaker as Featured Speaker of the conference (and latest
+        Featured Speaker overall) once the speaker has more than one session; used by featured
+        speaker task. Without session_names the names are read from the new sessions.
         """
-        speaker_key = ndb.Key(urlsafe=s_key).get().key
-        conf_key = ndb.Key(urlsafe=c_key).get().key
-
-        sessionsWithCurrentSpeaker = Session.query(ancestor=conf_key). \
-            filter(Session.speaker == speaker_key). \
-            fetch(projection=[Session.sessionName])
-
+        conf_key = ndb.Key(urlsafe=c_key)
+        speaker_key = ndb.Key(urlsafe=s_key)
+        if session_names is None:
+            new = ndb.get_multi([ndb.Key(urlsafe=wssk) for wssk in session_keys])
+            session_names = [getattr(sess, 'sessionName', None) for sess in new]
+        new_sessions = [(wssk, name) for wssk, name in zip(session_keys, session_names)
+                        if name is not None]
+        counts_key = '%s:%s:%s' % (MEMCACHE_SPEAKER_SESSIONS_PREFIX, c_key, s_key)
+
+        # append the new sessions with compare-and-set, so that concurrent
+        # tasks for the same speaker do not lose each other's sessions
+        client = memcache.Client()
+        for attempt in range(MEMCACHE_CAS_RETRIES):
+            sessions = client.gets(counts_key)
+            if sessions is None:
+                # first session of the speaker (or evicted entry): the only
+                # time the sessions of the speaker are queried
+                sessions = [(sess.key.urlsafe(), sess.sessionName) for sess in
+                            Session.query(ancestor=conf_key).
+                            filter(Session.speaker == speaker_key).
+                            fetch(projection=[Session.sessionName])]
+                if client.add(counts_key, sessions):
+                    break
+                continue
+            known = set(wssk for wssk, name in sessions)
+            added = [(wssk, name) for wssk, name in new_sessions if wssk not in known]
+            if not added:
+                break
+            sessions = sessions + added
+            if client.cas(counts_key, sessions):
+                break
+        else:
+            # too much contention on the entry, let the next task rebuild it
+            memcache.delete(counts_key)
 
-        if (len(sessionsWithCurrentSpeaker) > 1):
-            speakerName = ndb.Key(urlsafe=s_key).get().displayName
+        if len(sessions) > 1:
+            speakerName = cache.getEntity(speaker_key).displayName
             featuredspeaker = '%s %s %s' % (
                 speakerName,
                 'is featured speaker with session:',
-                ', '.join(session.sessionName for session in sessionsWithCurrentSpeaker))
-            memcache.set(MEMCACHE_SPEAKER_KEY, featuredspeaker)
-        else:
-            # If there are no featured speakers,
-            # delete the featured speaker memcache entry
-            featuredspeaker = ""
-            memcache.delete(MEMCACHE_SPEAKER_KEY)
+                ', '.join(name for wssk, name in sessions))
+            memcache.set_multi({
+                '%s:%s' % (MEMCACHE_SPEAKER_KEY, c_key): featuredspeaker,
+                MEMCACHE_SPEAKER_KEY: featuredspeaker,
+            })
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(FEATURED_SPEAKER_GET_REQUEST, StringMessage,
             path='sessions/featured_speakers',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return featured speaker from memcache."""
-        fspeaker = memcache.get(MEMCACHE_SPEAKER_KEY)
+        """Return featured speaker of the conference (latest one overall without websafeConferenceKey) from memcache.
+
+        It has no datastore backing to version (an evicted one is just gone),
+        its etag is a digest of the text; a match only saves the payload.
+        """
+        if request.websafeConferenceKey:
+            fspeaker = memcache.get('%s:%s' % (MEMCACHE_SPEAKER_KEY, request.websafeConferenceKey))
+        else:
+            fspeaker = memcache.get(MEMCACHE_SPEAKER_KEY)
         if not fspeaker:
             fspeaker = ""
-        return StringMessage(data=fspeaker)
+        etag = hashlib.sha1(fspeaker.encode('utf-8')).hexdigest()[:16]
+        if self._checkEtag(request, etag):
+            return StringMessage(data='', etag=etag, notModified=True)
+        return StringMessage(data=fspeaker, etag=etag)
 
 # registers API
-api = endpoints.api_server([ConferenceApi])
\ No newline at end of file
+api = endpoints.api_server([ConferenceApi])
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Udacity conference server-side Python App Engine conference counts by
+city, topic and month, for the filters of the conference search
+
+The counts are split across FACET_SHARDS FacetShard entities, each
+conference change updating a random one, and summed (then cached in
+memcache) on read. The /crons/reconcile_facets job recounts the stored
+conferences, one page per /tasks/reconcile_facets task, and adds the
+difference, which brings in the conferences created before the counts
+existed.
+
+"""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import FacetShard
+
+FACET_SHARDS = 10
+RECOUNT_BATCH_SIZE = 1000
+FACETS_TTL = 300
+MEMCACHE_FACETS_KEY = 'CONFERENCE_FACETS'
+# facet name (as the queryConferences filter field) -> Conference property
+FACET_FIELDS = {
+    'CITY': 'city',
+    'TOPIC': 'topics',
+    'MONTH': 'month',
+}
+
+
+def facetValues(conf):
+    """Return dict of facet name -> values of conf (None for no conf)."""
+    values = dict((facet, []) for facet in FACET_FIELDS)
+    if conf is None:
+        return values
+    for facet, field in FACET_FIELDS.items():
+        value = getattr(conf, field)
+        for v in (value if isinstance(value, list) else [value]):
+            # month 0 means no start date
+            if v not in (None, '', 0):
+                values[facet].append(unicode(v))
+    return values
+
+
+def countDeltas(old_values, new_values):
+    """Return dict of facet name -> {value: delta} from old to new values."""
+    deltas = {}
+    for facet in FACET_FIELDS:
+        counts = {}
+        for value in old_values.get(facet, []):
+            counts[value] = counts.get(value, 0) - 1
+        for value in new_values.get(facet, []):
+            counts[value] = counts.get(value, 0) + 1
+        counts = dict((value, n) for value, n in counts.items() if n)
+        if counts:
+            deltas[facet] = counts
+    return deltas
+
+
+def mergeDeltas(deltas, more):
+    """Add the deltas more into deltas."""
+    for facet, counts in more.items():
+        merged = deltas.setdefault(facet, {})
+        for value, n in counts.items():
+            merged[value] = merged.get(value, 0) + n
+    return deltas
+
+
+def recordChange(deltas):
+    """Add deltas to a random facet shard."""
+    if not deltas:
+        return
+    shard_key = ndb.Key(FacetShard, random.randrange(FACET_SHARDS))
+
+    @ndb.transactional()
+    def txn():
+        shard = shard_key.get() or FacetShard(key=shard_key, counts={})
+        mergeDeltas(shard.counts, deltas)
+        shard.put()
+
+    txn()
+    memcache.delete(MEMCACHE_FACETS_KEY)
+
+
+def _sumShards():
+    """Return dict of facet name -> {value: count summed over the shards}."""
+    facets = {}
+    shards = ndb.get_multi([ndb.Key(FacetShard, i) for i in range(FACET_SHARDS)])
+    for shard in shards:
+        if shard:
+            mergeDeltas(facets, shard.counts)
+    return facets
+
+
+def recountPage(actual, cursor=None, batch_size=RECOUNT_BATCH_SIZE):
+    """Add the facet values of one page of stored conferences to the
+    counts actual; return the urlsafe cursor of the next page (None
+    after the last one).
+    """
+    confs, next_cursor, more = Conference.query().fetch_page(
+        batch_size, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    for conf in confs:
+        mergeDeltas(actual, countDeltas({}, facetValues(conf)))
+    return next_cursor.urlsafe() if more and next_cursor else None
+
+
+def reconcile(actual):
+    """Add the difference between the recounted counts actual and the
+    shards to a shard; return the deltas added.
+
+    Changes made during the recount may be counted twice or not at all,
+    the next run corrects them.
+    """
+    stored = _sumShards()
+    deltas = {}
+    for facet in set(actual) | set(stored):
+        want, have = actual.get(facet, {}), stored.get(facet, {})
+        counts = dict((value, want.get(value, 0) - have.get(value, 0))
+                      for value in set(want) | set(have))
+        counts = dict((value, n) for value, n in counts.items() if n)
+        if counts:
+            deltas[facet] = counts
+    recordChange(deltas)
+    return deltas
+
+
+def getFacets():
+    """Return dict of facet name -> {value: number of conferences}.
+
+    Counts not above zero (left by conferences updated before the first
+    reconcile()) are dropped.
+    """
+    facets = memcache.get(MEMCACHE_FACETS_KEY)
+    if facets is None:
+        facets = _sumShards()
+        for facet, counts in facets.items():
+            facets[facet] = dict((value, n) for value, n in counts.items() if n > 0)
+        memcache.add(MEMCACHE_FACETS_KEY, facets, time=FACETS_TTL)
+    return facets
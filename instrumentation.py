@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""instrumentation.py
+
+Udacity conference server-side Python App Engine instrumentation of the
+ConferenceApi methods
+
+Every endpoints method records its wall time, the number and latency of
+its API RPCs (counted by apiproxy hooks), the entities it read and wrote
+and the time spent in the _copy*ToForm helpers. Values go into power of
+two histograms kept per instance and added to memcache counters every
+FLUSH_INTERVAL seconds. A share of the requests
+(INSTRUMENTATION_TRACE_RATE in settings.py) also logs each RPC it made.
+
+"""
+
+import functools
+import logging
+import math
+import random
+import re
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+from settings import INSTRUMENTATION_ENABLED
+from settings import INSTRUMENTATION_TRACE_RATE
+
+METRICS = ('wall_ms', 'rpc_ms', 'rpcs', 'copy_ms',
+           'entities_read', 'entities_written')
+# upper bounds of the histogram buckets; the last bucket has no bound
+BUCKETS = tuple(2 ** i for i in range(14))
+HISTOGRAM_PREFIX = 'instr:'
+FLUSH_INTERVAL = 10
+COPY_METHOD_RE = re.compile(r'^_copy\w*ToForm$')
+
+_local = threading.local()
+_pending = {}
+_pendingLock = threading.Lock()
+_lastFlush = [time.time()]
+
+
+class _Trace(object):
+    """Counters of one endpoints method call."""
+
+    def __init__(self, method, sampled):
+        self.method = method
+        self.start = time.time()
+        self.values = dict((metric, 0) for metric in METRICS)
+        self.started = {}
+        self.copying = False
+        self.calls = [] if sampled else None
+
+
+def _bucket(value):
+    """Return the index of the histogram bucket of value."""
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            return i
+    return len(BUCKETS)
+
+
+def _preCall(service, call, request, response, rpc):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.started[id(response)] = time.time()
+
+
+def _postCall(service, call, request, response, rpc, error):
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return
+    start = trace.started.pop(id(response), None)
+    elapsed = (time.time() - start) * 1000 if start else 0
+    trace.values['rpcs'] += 1
+    trace.values['rpc_ms'] += elapsed
+    if service == 'datastore_v3' and error is None:
+        if call == 'Get':
+            trace.values['entities_read'] += sum(
+                1 for e in response.entity_list() if e.has_entity())
+        elif call in ('RunQuery', 'Next'):
+            trace.values['entities_read'] += response.result_size()
+        elif call == 'Put':
+            trace.values['entities_written'] += request.entity_size()
+        elif call == 'Delete':
+            trace.values['entities_written'] += request.key_size()
+    if trace.calls is not None:
+        trace.calls.append('%s.%s %.1fms%s' % (
+            service, call, elapsed, ' (error)' if error else ''))
+
+
+def installHooks():
+    """Install the apiproxy hooks counting the RPCs (once per instance)."""
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append('instrumentation', _preCall)
+    apiproxy.GetPostCallHooks().Append('instrumentation', _postCall)
+
+
+def _timedMethod(name, func):
+    """Return func (an endpoints method) recording a trace per call."""
+    @functools.wraps(func)
+    def wrapper(service, request):
+        if not INSTRUMENTATION_ENABLED or getattr(_local, 'trace', None):
+            return func(service, request)
+        trace = _Trace(name, random.random() < INSTRUMENTATION_TRACE_RATE)
+        _local.trace = trace
+        try:
+            return func(service, request)
+        finally:
+            _local.trace = None
+            trace.values['wall_ms'] = (time.time() - trace.start) * 1000
+            _record(trace)
+    return wrapper
+
+
+def _timedCopy(func):
+    """Return func (a _copy*ToForm helper) adding its time to the trace."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = getattr(_local, 'trace', None)
+        if trace is None or trace.copying:
+            return func(*args, **kwargs)
+        trace.copying = True
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            trace.values['copy_ms'] += (time.time() - start) * 1000
+            trace.copying = False
+    return wrapper
+
+
+def instrumented(cls):
+    """Class decorator instrumenting the endpoints methods and the
+    _copy*ToForm helpers of a remote.Service class."""
+    for name, value in cls.__dict__.items():
+        if hasattr(value, 'remote'):
+            setattr(cls, name, _timedMethod(name, value))
+        elif COPY_METHOD_RE.match(name) and callable(value):
+            setattr(cls, name, _timedCopy(value))
+    installHooks()
+    return cls
+
+
+def _record(trace):
+    """Add the trace to the pending histograms, flushing them to memcache
+    every FLUSH_INTERVAL seconds."""
+    if trace.calls is not None:
+        logging.info('%s %.1fms, %d rpcs: %s', trace.method,
+                     trace.values['wall_ms'], trace.values['rpcs'],
+                     ', '.join(trace.calls))
+    prefix = '%s%s:' % (HISTOGRAM_PREFIX, trace.method)
+    with _pendingLock:
+        _pending[prefix + 'count'] = _pending.get(prefix + 'count', 0) + 1
+        for metric, value in trace.values.items():
+            value = int(math.ceil(value))
+            bucket_key = '%s%s:%d' % (prefix, metric, _bucket(value))
+            sum_key = '%s%s:sum' % (prefix, metric)
+            _pending[bucket_key] = _pending.get(bucket_key, 0) + 1
+            _pending[sum_key] = _pending.get(sum_key, 0) + value
+        if time.time() - _lastFlush[0] < FLUSH_INTERVAL:
+            return
+        counters = dict(_pending)
+        _pending.clear()
+        _lastFlush[0] = time.time()
+    memcache.offset_multi(counters, initial_value=0)
+
+
+def getHistograms(methods):
+    """Return dict of method -> {'count': calls, metric: {'sum': total,
+    'buckets': {upper bound ('inf' for the last): calls}}} from memcache."""
+    bounds = [str(bound) for bound in BUCKETS] + ['inf']
+    keys = []
+    for method in methods:
+        prefix = '%s%s:' % (HISTOGRAM_PREFIX, method)
+        keys.append(prefix + 'count')
+        for metric in METRICS:
+            keys.append('%s%s:sum' % (prefix, metric))
+            keys.extend('%s%s:%d' % (prefix, metric, i) for i in range(len(bounds)))
+    counters = memcache.get_multi(keys)
+
+    histograms = {}
+    for method in methods:
+        prefix = '%s%s:' % (HISTOGRAM_PREFIX, method)
+        count = counters.get(prefix + 'count')
+        if not count:
+            continue
+        histogram = {'count': count}
+        for metric in METRICS:
+            histogram[metric] = {
+                'sum': counters.get('%s%s:sum' % (prefix, metric), 0),
+                'buckets': dict((bound, counters['%s%s:%d' % (prefix, metric, i)])
+                                for i, bound in enumerate(bounds)
+                                if '%s%s:%d' % (prefix, metric, i) in counters),
+            }
+        histograms[method] = histogram
+    return histograms
@@ -1,11 +1,21 @@
 #!/usr/bin/env python
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import datastore_errors
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 from conference import ConferenceApi
+import bulk
+import facets
+import instrumentation
+import notifications
+import search
+import seats
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -13,15 +23,71 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
-class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
+class ReconcileFacetsHandler(webapp2.RequestHandler):
     def get(self):
+        """Start the recount of the conference facets."""
+        self.post()
+
+    def post(self):
+        """Recount the conference facets, one page per task, and fix the
+        shards after the last page."""
+        actual = json.loads(self.request.get('counts') or '{}')
+        try:
+            cursor = facets.recountPage(actual, self.request.get('cursor') or None)
+        except datastore_errors.BadValueError as e:
+            self.response.set_status(400)
+            self.response.write(str(e))
+            return
+        if cursor:
+            taskqueue.add(params={'cursor': cursor, 'counts': json.dumps(actual)},
+                          url='/tasks/reconcile_facets')
+        else:
+            facets.reconcile(actual)
+        self.response.set_status(204)
+
+class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
+    def post(self):
         """Set Featured Speaker in Memcache."""
-        ConferenceApi._cacheFeaturedSpeaker(self.request.get('conf_key'), self.request.get('speaker_key'))
+        ConferenceApi._cacheFeaturedSpeaker(
+            self.request.get('conf_key'), self.request.get('speaker_key'),
+            self.request.get_all('session_key'))
+        self.response.set_status(204)
+
+    def get(self):
+        """Set Featured Speaker in Memcache; drains the tasks enqueued
+        with the session names in their URL."""
+        ConferenceApi._cacheFeaturedSpeaker(
+            self.request.get('conf_key'), self.request.get('speaker_key'),
+            self.request.get_all('session_key'), self.request.get_all('session_name'))
+        self.response.set_status(204)
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write the seats left in the shards into the Conference."""
+        seats.syncSeats(self.request.get('conf_key'))
+        self.response.set_status(204)
+
+class IndexSearchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the search index of Conferences & Sessions."""
+        search.indexEntities([ndb.Key(urlsafe=key)
+                              for key in self.request.get_all('key')])
         self.response.set_status(204)
 
+class SendMailHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send the queued confirmation emails (cron)."""
+        notifications.sendPending()
+        self.response.set_status(204)
+
+    def post(self):
+        """Send the queued confirmation emails."""
+        self.get()
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation; drains the tasks
+        enqueued before the mail queue."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -32,8 +98,94 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
+class ImportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Import Conferences, Sessions & Speakers from JSON lines."""
+        self.response.headers['Content-Type'] = 'application/json'
+        try:
+            counts = bulk.importLines(self.request.body_file)
+        except bulk.ImportFailed as e:
+            # the batches before the line are committed: resume after
+            # committedThrough, or keyless records are imported twice
+            self.response.set_status(400)
+            self.response.write(json.dumps({
+                'error': str(e),
+                'line': e.line,
+                'imported': e.counts,
+                'committedThrough': e.committedThrough,
+            }))
+            return
+        self.response.write(json.dumps(counts))
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Export Conferences, Sessions & Speakers as JSON lines; resume
+        from the X-Next-Position header of the response, if any."""
+        self.response.headers['Content-Type'] = 'application/x-ndjson'
+        try:
+            position = bulk.exportLines(self.response.write,
+                                        self.request.get('position') or None)
+        except ValueError as e:
+            self.response.clear()
+            self.response.headers['Content-Type'] = 'text/plain'
+            self.response.set_status(400)
+            self.response.write(str(e))
+            return
+        if position:
+            self.response.headers['X-Next-Position'] = position
+
+class ReputHandler(webapp2.RequestHandler):
+    def post(self):
+        """Put all the entities of a kind again, one page per task."""
+        kind = self.request.get('kind')
+        try:
+            cursor = bulk.reputPage(kind, self.request.get('cursor') or None)
+        except ValueError as e:
+            self.response.set_status(400)
+            self.response.write(str(e))
+            return
+        if cursor:
+            taskqueue.add(params={'kind': kind, 'cursor': cursor},
+                          url='/tasks/reput')
+        self.response.set_status(204)
+
+class MigrateProfilesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move the legacy registrations & wishlists of all the profiles
+        into their entities, one page per task."""
+        try:
+            cursor = ConferenceApi._migrateProfilesPage(self.request.get('cursor') or None)
+        except datastore_errors.BadValueError as e:
+            self.response.set_status(400)
+            self.response.write(str(e))
+            return
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                          url='/tasks/migrate_profiles')
+        self.response.set_status(204)
+
+class InstrumentationHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the histograms of the ConferenceApi methods as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(instrumentation.getHistograms(
+            sorted(ConferenceApi.all_remote_methods())), sort_keys=True))
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/reconcile_facets', ReconcileFacetsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/send_mail', SendMailHandler),
+    ('/crons/send_mail', SendMailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/index_search', IndexSearchHandler),
+    ('/admin/import', ImportHandler),
+    ('/admin/export', ExportHandler),
+    ('/admin/reput', ReputHandler),
+    ('/admin/migrate_profiles', MigrateProfilesHandler),
+    ('/admin/instrumentation', InstrumentationHandler),
+    ('/tasks/reput', ReputHandler),
+    ('/tasks/migrate_profiles', MigrateProfilesHandler),
+    ('/tasks/reconcile_facets', ReconcileFacetsHandler),
 ], debug=True)
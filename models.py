@@ -24,10 +24,26 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy, moved into Registration and WishlistEntry entities on
+    # first profile read
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionsWishlist = ndb.KeyProperty(kind='Session', repeated=True)
 
 
+class Registration(ndb.Model):
+    """Registration -- Profile attending a Conference; child of the
+    Profile with the websafe Conference key as id"""
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- Session in the wishlist of a Profile; child of the
+    Profile with the websafe Session key as id"""
+    session = ndb.KeyProperty(kind='Session', required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -42,6 +58,12 @@ class ProfileForm(messages.Message):
     teeShirtSize = messages.EnumField('TeeShirtSize', 4)
 
 
+class ProfileForms(messages.Message):
+    """ProfileForms -- multiple Profile outbound form message"""
+    items = messages.MessageField(ProfileForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+
+
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
     NOT_SPECIFIED = 1
@@ -72,6 +94,50 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- share of the seats of a Conference; a root entity
+    so that registrations to one conference spread over entity groups"""
+    conference      = ndb.KeyProperty(kind='Conference', required=True)
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+
+class FacetShard(ndb.Model):
+    """FacetShard -- share of the conference counts by facet name (CITY,
+    TOPIC, MONTH) and value"""
+    counts = ndb.JsonProperty()
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- indexed text of a Conference or Session, keyed by
+    its websafe key"""
+    kind            = ndb.StringProperty(indexed=False)
+    title           = ndb.StringProperty(indexed=False)
+    scores          = ndb.JsonProperty()
+
+class SearchPosting(ndb.Model):
+    """SearchPosting -- occurrence of a token in a SearchDocument, its
+    parent, keyed by the token"""
+    token           = ndb.StringProperty()
+    document        = ndb.KeyProperty(indexed=False)
+    kind            = ndb.StringProperty(indexed=False)
+    score           = ndb.IntegerProperty()
+
+class SearchResultForm(messages.Message):
+    """SearchResultForm -- search result outbound form message"""
+    kind            = messages.StringField(1)
+    websafeKey      = messages.StringField(2)
+    title           = messages.StringField(3)
+    score           = messages.IntegerField(4)
+
+class SearchResultForms(messages.Message):
+    """SearchResultForms -- multiple SearchResultForm outbound form message"""
+    items = messages.MessageField(SearchResultForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+
+class Announcement(ndb.Model):
+    """Announcement -- nearly sold out conferences (websafe key -> name);
+    a single entity backing the announcement in memcache"""
+    conferences = ndb.JsonProperty()
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -87,10 +153,24 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    queryPlan = messages.StringField(3)
+
+class FacetForm(messages.Message):
+    """FacetForm -- number of conferences with a filter value outbound form message"""
+    field = messages.StringField(1)
+    value = messages.StringField(2)
+    count = messages.IntegerField(3)
+
+class FacetForms(messages.Message):
+    """FacetForms -- multiple FacetForm outbound form message"""
+    items = messages.MessageField(FacetForm, 1, repeated=True)
 
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
@@ -101,6 +181,8 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    cursor = messages.StringField(3)
 
 # needed for conference registration
 class BooleanMessage(messages.Message):
@@ -114,6 +196,26 @@ class ConflictException(endpoints.ServiceException):
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
+
+class CacheStatsForm(messages.Message):
+    """CacheStatsForm -- cache hit/miss counters outbound form message"""
+    name = messages.StringField(1)
+    hits = messages.IntegerField(2)
+    misses = messages.IntegerField(3)
+
+class CacheStatsForms(messages.Message):
+    """CacheStatsForms -- multiple CacheStatsForm outbound form message"""
+    items = messages.MessageField(CacheStatsForm, 1, repeated=True)
+
+def sessionTypeSets(type_of_session):
+    """Return the names of the sets of session types containing
+    type_of_session, e.g. KEYNOTE,LECTURE for a lecture."""
+    others = sorted(t.name for t in SessionTypes if t.name != type_of_session)
+    return [','.join(sorted([type_of_session] +
+                            [name for j, name in enumerate(others) if i >> j & 1]))
+            for i in range(2 ** len(others))]
 
 class Session(ndb.Model):
     """Session -- session object"""
@@ -124,6 +226,9 @@ class Session(ndb.Model):
     typeOfSession   = ndb.StringProperty(default='LECTURE')
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
+    # lets a query for several types be one equality filter instead of IN
+    typeSets        = ndb.ComputedProperty(
+        lambda self: sessionTypeSets(self.typeOfSession), repeated=True)
 
 
 class SessionTypes(messages.Enum):
@@ -147,6 +252,19 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
+
+class ConflictForm(messages.Message):
+    """ConflictForm -- overlapping sessions outbound form message"""
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+
+class AgendaForm(messages.Message):
+    """AgendaForm -- wishlist agenda outbound form message"""
+    schedule    = messages.MessageField(SessionForm, 1, repeated=True)
+    conflicts   = messages.MessageField(ConflictForm, 2, repeated=True)
+    unscheduled = messages.MessageField(SessionForm, 3, repeated=True)
 
 class Speaker(ndb.Model):
     """Speaker -- speaker profile object"""
@@ -159,3 +277,5 @@ class SpeakerForm(messages.Message):
     displayName = messages.StringField(1)
     mainEmail = messages.StringField(2)
     speakerKey = messages.StringField(3)
+    etag = messages.StringField(4)
+    notModified = messages.BooleanField(5)
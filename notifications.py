@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""notifications.py
+
+Udacity conference server-side Python App Engine confirmation emails
+
+Notifications are compact JSON payloads in the "mail" pull queue. The
+/tasks/send_mail worker leases them in batches and sends them; a
+notification whose send fails stays leased and comes back when its lease
+expires, and one that was sent is remembered in memcache so that a
+re-leased copy is not sent twice.
+
+"""
+
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+MAIL_QUEUE = 'mail'
+LEASE_SECONDS = 60
+LEASE_BATCH_SIZE = 100
+MAX_BATCHES = 10
+MAX_MAIL_RETRIES = 5
+DELIVERY_INTERVAL = 5
+SENT_PREFIX = 'mail-sent:'
+SENT_TTL = 24 * 3600
+
+MESSAGES = {
+    'conference': (
+        'You created a new Conference!',
+        'Hi, you have created the following conference:\r\n\r\n'
+        '%(name)s\r\n%(city)s, %(startDate)s'),
+    'registration': (
+        'You registered for a Conference!',
+        'Hi, you are registered for the following conference:\r\n\r\n'
+        '%(name)s\r\n%(city)s, %(startDate)s'),
+}
+
+
+def queueMail(kind, to, conf):
+    """Queue the confirmation email of kind (conference, registration)
+    about conf to the address to, and schedule its delivery."""
+    payload = {
+        'kind': kind,
+        'to': to,
+        'name': conf.name,
+        'city': conf.city or '',
+        'startDate': str(conf.startDate or ''),
+    }
+    taskqueue.Queue(MAIL_QUEUE).add(taskqueue.Task(
+        payload=json.dumps(payload, separators=(',', ':')), method='PULL'))
+    scheduleDelivery()
+
+
+def scheduleDelivery():
+    """Enqueue a run of the worker, at most one per DELIVERY_INTERVAL
+    (named tasks collapse the others)."""
+    try:
+        taskqueue.add(url='/tasks/send_mail',
+                      name='mail-%d' % (time.time() // DELIVERY_INTERVAL),
+                      countdown=DELIVERY_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def renderMail(payload):
+    """Return (subject, body) of the email of a payload."""
+    subject, body = MESSAGES[payload['kind']]
+    return subject, body % payload
+
+
+def sendPending():
+    """Lease the queued notifications in batches and send them; return
+    the number of emails sent."""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    sender = 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+    sent = 0
+    for batch in range(MAX_BATCHES):
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH_SIZE)
+        if not tasks:
+            break
+        markers = memcache.get_multi([task.name for task in tasks],
+                                     key_prefix=SENT_PREFIX)
+        done = []
+        for task in tasks:
+            if task.name in markers:
+                # sent before its delete went through
+                done.append(task)
+                continue
+            try:
+                payload = json.loads(task.payload)
+                to = payload['to']
+                subject, body = renderMail(payload)
+            except (ValueError, KeyError, TypeError):
+                logging.error('Dropping invalid notification %s', task.name)
+                done.append(task)
+                continue
+            try:
+                mail.send_mail(sender, to, subject, body)
+            except Exception:
+                # retried once its lease expires, up to MAX_MAIL_RETRIES
+                if task.retry_count >= MAX_MAIL_RETRIES:
+                    logging.exception('Dropping notification %s', task.name)
+                    done.append(task)
+                else:
+                    logging.warning('Sending notification %s failed', task.name)
+                continue
+            memcache.set(SENT_PREFIX + task.name, 1, time=SENT_TTL)
+            done.append(task)
+            sent += 1
+        if done:
+            queue.delete_tasks(done)
+        if len(tasks) < LEASE_BATCH_SIZE:
+            break
+    else:
+        # more left than one run sends
+        scheduleDelivery()
+    return sent
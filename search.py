@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Udacity conference server-side Python App Engine full-text search over
+conferences and sessions with an inverted token index
+
+Each searchable entity has a SearchDocument (its title and token scores)
+and one SearchPosting child per token, so a search reads the postings of
+a token ordered by score instead of scanning the entities. Documents are
+(re)indexed by the /tasks/index_search task, each in a transaction over
+the entity and the entity group of its document.
+
+"""
+
+import re
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SearchDocument
+from models import SearchPosting
+
+# kind -> (property, weight) of the indexed text
+INDEXED_FIELDS = {
+    'Conference': (('name', 3), ('topics', 2), ('description', 1)),
+    'Session': (('sessionName', 3), ('highlights', 1)),
+}
+TITLE_FIELDS = {
+    'Conference': 'name',
+    'Session': 'sessionName',
+}
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+])
+MIN_TOKEN_LENGTH = 2
+MAX_DOCUMENT_TOKENS = 200
+SEARCH_SCAN_LIMIT = 1000
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Return the lowercase tokens of text, without stop words."""
+    return [token for token in TOKEN_RE.findall((text or u'').lower())
+            if len(token) >= MIN_TOKEN_LENGTH and token not in STOP_WORDS]
+
+
+def documentScores(entity):
+    """Return dict of token -> score of entity, the weights of the fields
+    the token occurs in summed per occurrence."""
+    scores = {}
+    for field, weight in INDEXED_FIELDS[entity._get_kind()]:
+        value = getattr(entity, field)
+        for text in (value if isinstance(value, list) else [value]):
+            for token in tokenize(text):
+                scores[token] = scores.get(token, 0) + weight
+    if len(scores) > MAX_DOCUMENT_TOKENS:
+        kept = sorted(scores, key=lambda token: (-scores[token], token))
+        scores = dict((token, scores[token]) for token in kept[:MAX_DOCUMENT_TOKENS])
+    return scores
+
+
+def _postingKey(token, doc_id):
+    return ndb.Key(SearchDocument, doc_id, SearchPosting, token)
+
+
+def scheduleIndex(keys):
+    """Enqueue the (re)indexing of the entities of keys."""
+    if keys:
+        taskqueue.add(params={'key': [key.urlsafe() for key in keys]},
+                      url='/tasks/index_search')
+
+
+def indexEntities(keys):
+    """Bring the index of the entities of keys up to date with their
+    current text, removing the postings of deleted entities.
+
+    Only the postings whose score changed are written.
+    """
+    for key in keys:
+        _indexEntity(key)
+
+
+@ndb.transactional(xg=True)
+def _indexEntity(key):
+    """Index the entity of key; concurrent tasks for the same entity
+    retry, so the last one to commit indexes its latest text."""
+    doc_id = key.urlsafe()
+    entity, doc = ndb.get_multi([key, ndb.Key(SearchDocument, doc_id)])
+    old = doc.scores if doc else {}
+    if entity is None:
+        ndb.delete_multi([_postingKey(token, doc_id) for token in old] +
+                         ([doc.key] if doc else []))
+        return
+
+    kind = key.kind()
+    scores = documentScores(entity)
+    title = getattr(entity, TITLE_FIELDS[kind])
+    puts = [SearchPosting(key=_postingKey(token, doc_id), token=token,
+                          document=key, kind=kind, score=score)
+            for token, score in scores.items() if old.get(token) != score]
+    if not doc or doc.scores != scores or doc.title != title:
+        puts.append(SearchDocument(id=doc_id, kind=kind, title=title,
+                                   scores=scores))
+    ndb.put_multi(puts)
+    ndb.delete_multi([_postingKey(token, doc_id)
+                      for token in old if token not in scores])
+
+
+def search(text, page_size, start_cursor=None):
+    """Return the documents matching all the tokens of text, one page at a
+    time, and the cursor of the next page (None when there is no more).
+
+    The postings of the longest token (usually the least common) are read
+    by descending score; the other tokens are checked with key lookups of
+    their postings. At most SEARCH_SCAN_LIMIT postings are read per call,
+    so a page may come back short with a cursor to continue from. Results
+    are (SearchDocument, score) pairs, ranked by the summed score of the
+    tokens within the page only: pages follow the score of the longest
+    token, so a later page may hold a better summed score.
+    """
+    tokens = sorted(set(tokenize(text)), key=lambda token: (-len(token), token))
+    if not tokens:
+        return [], None
+    lead, others = tokens[0], tokens[1:]
+    query = SearchPosting.query(SearchPosting.token == lead).order(-SearchPosting.score)
+
+    hits = []
+    cursor = start_cursor
+    scanned = 0
+    more = True
+    while more and len(hits) < page_size and scanned < SEARCH_SCAN_LIMIT:
+        # never read past the end of the page, so the cursor stays exact
+        postings, cursor, more = query.fetch_page(
+            page_size - len(hits), start_cursor=cursor)
+        scanned += len(postings)
+        more = more and cursor is not None
+        doc_ids = [posting.document.urlsafe() for posting in postings]
+        matches = ndb.get_multi([_postingKey(token, doc_id)
+                                 for doc_id in doc_ids for token in others])
+        for i, posting in enumerate(postings):
+            found = matches[i * len(others):(i + 1) * len(others)]
+            if all(found):
+                hits.append((doc_ids[i], posting.score +
+                             sum(match.score for match in found)))
+
+    docs = ndb.get_multi([ndb.Key(SearchDocument, doc_id) for doc_id, _ in hits])
+    results = sorted([(doc, score) for doc, (_, score) in zip(docs, hits) if doc],
+                     key=lambda result: -result[1])
+    return results, (cursor if more else None)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine sharded seat counter
+
+The seats of a conference are split across SeatShard root entities, so
+registrations to the same conference commit in different entity groups.
+A shard never goes below zero, which keeps the conference from being
+oversold. The sum over the shards is cached in memcache and written back
+into Conference.seatsAvailable at most once per SYNC_INTERVAL by the
+/tasks/sync_seats task. Every change of the sum bumps the seats version
+of the conference, part of the ETag of getConference.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+import cache
+
+SEATS_PER_SHARD = 20
+MAX_SHARDS = 20
+SEATS_PREFIX = 'seats:'
+SEATS_TTL = 60
+SYNC_INTERVAL = 10
+
+
+class ShardExhausted(Exception):
+    """Raised in a registration transaction when the picked shard has no
+    seat left anymore; the registration retries on another shard."""
+
+
+def shardCount(max_attendees):
+    """Return the number of shards for a conference of max_attendees."""
+    shards = (max(max_attendees or 0, 0) + SEATS_PER_SHARD - 1) // SEATS_PER_SHARD
+    return max(1, min(MAX_SHARDS, shards))
+
+
+def shardKeys(conf_key, count):
+    """Return the keys of the count seat shards of the conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i)) for i in range(count)]
+
+
+def makeShards(conf_key, seats, count):
+    """Return (unsaved) SeatShards sharing seats evenly."""
+    base, extra = divmod(max(seats or 0, 0), count)
+    return [SeatShard(key=key, conference=conf_key,
+                      seatsAvailable=base + (1 if i < extra else 0))
+            for i, key in enumerate(shardKeys(conf_key, count))]
+
+
+def ensureShards(conf):
+    """Return the shard keys of conf, splitting the seats of a conference
+    created before seat shards into shards first.
+    """
+    if conf.seatShards:
+        return shardKeys(conf.key, conf.seatShards)
+
+    @ndb.transactional(xg=True)
+    def txn():
+        conf_ = conf.key.get()
+        if not conf_.seatShards:
+            conf_.seatShards = shardCount(conf_.maxAttendees)
+            ndb.put_multi([conf_] + makeShards(
+                conf_.key, conf_.seatsAvailable, conf_.seatShards))
+            cache.invalidateEntities([conf_.key])
+        return conf_.seatShards
+
+    conf.seatShards = txn()
+    return shardKeys(conf.key, conf.seatShards)
+
+
+def pickShard(shard_keys, with_seats=True):
+    """Return the key of a random shard, one with seats left when
+    with_seats (None when the conference is sold out).
+    """
+    if not with_seats:
+        return random.choice(shard_keys)
+    shards = [shard for shard in ndb.get_multi(shard_keys)
+              if shard and shard.seatsAvailable > 0]
+    if not shards:
+        return None
+    return random.choice(shards).key
+
+
+def getSeatsAvailable(confs):
+    """Return dict of conference key -> seats available.
+
+    Sharded conferences are summed over their shards, the sums being
+    cached in memcache for SEATS_TTL seconds.
+    """
+    seats = dict((conf.key, conf.seatsAvailable)
+                 for conf in confs if not conf.seatShards)
+    sharded = dict((SEATS_PREFIX + conf.key.urlsafe(), conf)
+                   for conf in confs if conf.seatShards)
+    if not sharded:
+        return seats
+
+    cached = memcache.get_multi(sharded.keys())
+    missing = [conf for cache_key, conf in sharded.items()
+               if cache_key not in cached]
+    if missing:
+        keys = [shardKeys(conf.key, conf.seatShards) for conf in missing]
+        shards = iter(ndb.get_multi([key for ks in keys for key in ks]))
+        summed = {}
+        for conf, ks in zip(missing, keys):
+            summed[SEATS_PREFIX + conf.key.urlsafe()] = sum(
+                getattr(next(shards), 'seatsAvailable', 0) for _ in ks)
+        memcache.add_multi(summed, time=SEATS_TTL)
+        cached.update(summed)
+
+    for cache_key, conf in sharded.items():
+        seats[conf.key] = cached[cache_key]
+    return seats
+
+
+def recordChange(conf_key, delta):
+    """Apply a committed change of delta seats to the cached sum and
+    schedule the write-back into the Conference entity; return the new
+    cached sum (None when it is not cached).
+    """
+    cache_key = SEATS_PREFIX + conf_key.urlsafe()
+    seats = memcache.offset_multi({cache_key: delta}).get(cache_key)
+    cache.bumpVersions([cache_key])
+    scheduleSync(conf_key)
+    return seats
+
+
+def scheduleSync(conf_key):
+    """Enqueue the write-back of the seats of the conference, at most one
+    per SYNC_INTERVAL (named tasks collapse the others).
+    """
+    wsck = conf_key.urlsafe()
+    try:
+        taskqueue.add(params={'conf_key': wsck},
+                      url='/tasks/sync_seats',
+                      name='seats-%s-%d' % (wsck, int(time.time() // SYNC_INTERVAL)),
+                      countdown=SYNC_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def sumShards(conf):
+    """Return the seats available of a sharded conference, summed over
+    its shards (not cached)."""
+    return sum(shard.seatsAvailable for shard in
+               ndb.get_multi(shardKeys(conf.key, conf.seatShards)) if shard)
+
+
+def adjustSeats(conf_key, delta):
+    """Add delta seats (removing when negative) to the shards of the
+    conference, adding shards when its maxAttendees outgrew them; return
+    the number of seats that could not be removed.
+
+    Seats already taken are never removed, a shard stops at zero. Seats
+    taken since maxAttendees was checked against the registrations are
+    added back to maxAttendees, so it never drops below them.
+    """
+    @ndb.transactional(xg=True)
+    def txn():
+        conf = conf_key.get()
+        count = max(conf.seatShards, shardCount(conf.maxAttendees))
+        keys = shardKeys(conf_key, count)
+        shards = [shard or SeatShard(key=key, conference=conf_key)
+                  for key, shard in zip(keys, ndb.get_multi(keys))]
+        remaining = max(-delta, 0)
+        if delta > 0:
+            base, extra = divmod(delta, count)
+            for i, shard in enumerate(shards):
+                shard.seatsAvailable += base + (1 if i < extra else 0)
+        for shard in sorted(shards, key=lambda s: -s.seatsAvailable):
+            taken = min(remaining, shard.seatsAvailable)
+            shard.seatsAvailable -= taken
+            remaining -= taken
+        if count != conf.seatShards or remaining:
+            conf.seatShards = count
+            conf.maxAttendees += remaining
+            shards.append(conf)
+            cache.invalidateEntities([conf_key])
+        ndb.put_multi(shards)
+        return remaining
+
+    unpaid = txn()
+    memcache.delete(SEATS_PREFIX + conf_key.urlsafe())
+    cache.bumpVersions([SEATS_PREFIX + conf_key.urlsafe()])
+    scheduleSync(conf_key)
+    return unpaid
+
+
+def syncSeats(wsck):
+    """Write the sum of the shards into Conference.seatsAvailable."""
+    conf_key = ndb.Key(urlsafe=wsck)
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return
+    total = sumShards(conf)
+
+    @ndb.transactional()
+    def txn():
+        conf = conf_key.get()
+        if conf.seatsAvailable != total:
+            conf.seatsAvailable = total
+            conf.put()
+            cache.invalidateEntities([conf_key])
+
+    txn()
+    changed = memcache.get(SEATS_PREFIX + wsck) != total
+    memcache.set(SEATS_PREFIX + wsck, total, time=SEATS_TTL)
+    if changed:
+        cache.bumpVersions([SEATS_PREFIX + wsck])
@@ -14,3 +14,8 @@ created/forked from conference.py by wesc on 2014 may 24
 # Console or Cloud Console.
 WEB_CLIENT_ID = '893500458498-jgdjakhanshp6nl2ee093jou591qqbmq.apps.googleusercontent.com'
 
+# Instrumentation of the ConferenceApi methods (see instrumentation.py);
+# the given share of the requests logs every RPC it makes.
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_TRACE_RATE = 0.0
+
@@ -76,6 +76,34 @@ app.constant('HTTP_ERRORS', {
 });
 
 
+/**
+ * @ngdoc service
+ * @name conditionalGet
+ *
+ * @description
+ * Calls a read method of the conference API with the etag of the result it returned last time
+ * for the same parameters, reusing that result when the server answers notModified.
+ *
+ */
+app.factory('conditionalGet', function () {
+    var cached = {};
+
+    return function (method, params, callback) {
+        var key = method + ':' + JSON.stringify(params);
+        var entry = cached[key];
+        var request = angular.extend({}, params, entry ? {ifNoneMatch: entry.etag} : {});
+        gapi.client.conference[method](request).execute(function (resp) {
+            if (!resp.error && resp.result && resp.result.notModified && entry) {
+                resp = {result: entry.result};
+            } else if (!resp.error && resp.result && resp.result.etag) {
+                cached[key] = {etag: resp.result.etag, result: resp.result};
+            }
+            callback(resp);
+        });
+    };
+});
+
+
 /**
  * @ngdoc service
  * @name oauth2Provider
@@ -273,6 +273,12 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         {enumValue: 'MAX_ATTENDEES', displayName: 'Max Attendees'}
     ]
 
+    /**
+     * Holds the number of conferences per filter value, keyed by field enumValue.
+     * @type {Object}
+     */
+    $scope.facets = null;
+
     /**
      * Possible operators.
      *
@@ -305,9 +311,32 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.tabAllSelected = function () {
         $scope.selectedTab = 'ALL';
+        if (!$scope.facets) {
+            $scope.getConferenceFacets();
+        }
         $scope.queryConferences();
     };
 
+    /**
+     * Invokes the conference.getConferenceFacets API to fetch the counts shown along the filter values.
+     */
+    $scope.getConferenceFacets = function () {
+        gapi.client.conference.getConferenceFacets().
+            execute(function (resp) {
+                $scope.$apply(function () {
+                    if (resp.error) {
+                        $log.error('Failed to get conference facets : ' + (resp.error.message || ''));
+                    } else {
+                        $scope.facets = {};
+                        angular.forEach(resp.items, function (facet) {
+                            $scope.facets[facet.field] = $scope.facets[facet.field] || [];
+                            $scope.facets[facet.field].push({value: facet.value, count: facet.count});
+                        });
+                    }
+                });
+            });
+    };
+
     /**
      * Sets the selected tab to 'YOU_HAVE_CREATED'
      */
@@ -346,15 +375,64 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     $scope.pagination = $scope.pagination || {};
     $scope.pagination.currentPage = 0;
     $scope.pagination.pageSize = 20;
+
+    /**
+     * Holds the server cursors of the pages fetched so far in the 'ALL' and 'YOU_WILL_ATTEND' tabs.
+     * cursors[i] is the cursor the page i starts at (null for the first page).
+     * @type {Array}
+     */
+    $scope.pagination.cursors = [null];
+
+    /**
+     * Returns if the pages are fetched one by one from the server.
+     * The 'ALL' and 'YOU_WILL_ATTEND' tabs are paged by the server, the other one is paged in the client.
+     *
+     * @returns {boolean}
+     */
+    $scope.pagination.isServerSide = function () {
+        return $scope.selectedTab == 'ALL' || $scope.selectedTab == 'YOU_WILL_ATTEND';
+    };
+
+    /**
+     * Returns the index of the first conference of the current page in $scope.conferences.
+     *
+     * @returns {number}
+     */
+    $scope.pagination.offset = function () {
+        if ($scope.pagination.isServerSide()) {
+            return 0;
+        }
+        return $scope.pagination.currentPage * $scope.pagination.pageSize;
+    };
+
     /**
      * Returns the number of the pages in the pagination.
+     * For the server side pagination, only the pages reachable through the known cursors are counted.
      *
      * @returns {number}
      */
     $scope.pagination.numberOfPages = function () {
+        if ($scope.pagination.isServerSide()) {
+            return $scope.pagination.cursors.length;
+        }
         return Math.ceil($scope.conferences.length / $scope.pagination.pageSize);
     };
 
+    /**
+     * Moves to the page specified, fetching it from the server if needed.
+     *
+     * @param page the index of the page
+     */
+    $scope.pagination.goTo = function (page) {
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll(page);
+        } else if ($scope.selectedTab == 'YOU_WILL_ATTEND') {
+            $scope.getConferencesAttend(page);
+        } else {
+            $scope.pagination.currentPage = page;
+        }
+    };
+
     /**
      * Returns an array including the numbers from 1 to the number of the pages.
      *
@@ -414,6 +492,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.pagination.currentPage = 0;
+        $scope.pagination.cursors = [null];
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -424,11 +504,18 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Invokes the conference.queryConferences API to fetch one page of conferences.
+     *
+     * @param page the index of the page to fetch, the first page if omitted.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (page) {
+        page = page || 0;
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize
+        }
+        if ($scope.pagination.cursors[page]) {
+            sendFilters.cursor = $scope.pagination.cursors[page];
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -462,6 +549,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+
+                        // Keep the cursors up to the page fetched, then the one of the next page if any.
+                        $scope.pagination.currentPage = page;
+                        $scope.pagination.cursors = $scope.pagination.cursors.slice(0, page + 1);
+                        if (resp.nextCursor) {
+                            $scope.pagination.cursors.push(resp.nextCursor);
+                        }
                     }
                     $scope.submitted = true;
                 });
@@ -506,12 +600,20 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Retrieves the conferences to attend by calling the conference.getProfile method and
-     * invokes the conference.getConference method n times where n == the number of the conferences to attend.
+     * Retrieves one page of the conferences to attend by calling the conference.getConferencesToAttend method.
+     *
+     * @param page the index of the page to fetch, the first page if omitted.
      */
-    $scope.getConferencesAttend = function () {
+    $scope.getConferencesAttend = function (page) {
+        page = page || 0;
+        var params = {
+            pageSize: $scope.pagination.pageSize
+        };
+        if ($scope.pagination.cursors[page]) {
+            params.cursor = $scope.pagination.cursors[page];
+        }
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
+        gapi.client.conference.getConferencesToAttend(params).
             execute(function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
@@ -527,11 +629,17 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         }
                     } else {
                         // The request has succeeded.
-                        $scope.conferences = resp.result.items;
+                        $scope.conferences = resp.result.items || [];
                         $scope.loading = false;
                         $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
+
+                        $scope.pagination.currentPage = page;
+                        $scope.pagination.cursors = $scope.pagination.cursors.slice(0, page + 1);
+                        if (resp.result.nextCursor) {
+                            $scope.pagination.cursors.push(resp.result.nextCursor);
+                        }
                     }
                     $scope.submitted = true;
                 });
@@ -547,21 +655,22 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS, conditionalGet) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
 
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConference method (through conditionalGet) and sets the returned
+     * conference in the $scope.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        conditionalGet('getConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""test_announcement.py
+
+Nearly sold out announcement kept up to date by registrations
+
+"""
+
+import unittest
+
+import testbase
+
+
+class AnnouncementTest(testbase.StubTestCase):
+
+    def announcement(self):
+        import conference
+        return self.harness.newRequest().getAnnouncement(
+            conference.ANNOUNCEMENT_GET_REQUEST.combined_message_class()).data
+
+    def testRegistrationUpdatesAnnouncement(self):
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        from models import ConferenceForm
+
+        self.harness.generateCatalog(1, 0)
+        self.harness.asUser(self.harness.profiles[0])
+        created = self.harness.newRequest().createConference(ConferenceForm(
+            name='Small Conference', maxAttendees=6))
+        conf_key = ndb.Key(urlsafe=created.websafeKey)
+        self.assertEqual(self.announcement(), '')
+
+        self.harness.register(self.harness.profiles[1], conf_key)
+        self.assertIn('Small Conference', self.announcement())
+
+        # a read of the entity made before the unregistration cannot
+        # put back its announcement
+        self.harness.register(self.harness.profiles[1], conf_key, reg=False)
+        ConferenceApi._setAnnouncement(
+            {conf_key.urlsafe(): 'Small Conference'}, rebuild=True)
+        self.assertEqual(self.announcement(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""test_bulk.py
+
+Conferences and sessions imported over the stored ones
+
+"""
+
+import json
+import unittest
+
+import testbase
+
+
+class BulkImportTest(testbase.StubTestCase):
+
+    def testReimportKeepsSeatsTaken(self):
+        import bulk
+        import seats
+
+        self.harness.generateCatalog(1, 0)
+        conf_key, organizer = self.harness.conferences[0]
+        for email in self.harness.profiles[:3]:
+            self.harness.register(email, conf_key)
+        conf = conf_key.get()
+        self.assertEqual(seats.sumShards(conf), conf.maxAttendees - 3)
+
+        # an export taken before the registrations, with 10 more seats
+        record = json.loads(bulk.toJson(conf))
+        record['seatsAvailable'] = record['maxAttendees']
+        record['maxAttendees'] += 10
+        bulk.importLines([json.dumps(record)])
+
+        conf = conf_key.get()
+        self.assertEqual(seats.sumShards(conf), conf.maxAttendees - 3)
+        self.assertEqual(seats.getSeatsAvailable([conf])[conf_key], conf.maxAttendees - 3)
+
+    def testImportedSessionsFeatureTheirSpeaker(self):
+        import bulk
+        import conference
+
+        self.harness.generateCatalog(1, 0, speakers=1)
+        conf_key, organizer = self.harness.conferences[0]
+        speaker_key = self.harness.speakers[0]
+        bulk.importLines([json.dumps({
+            'kind': 'Session',
+            'conference': bulk._encode(conf_key),
+            'sessionName': 'Imported %d' % i,
+            'speaker': bulk._encode(speaker_key),
+        }) for i in range(2)])
+
+        self.assertEqual(self.runTasks('/tasks/set_featured_speaker'), 1)
+        featured = self.harness.newRequest().getFeaturedSpeaker(
+            conference.FEATURED_SPEAKER_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf_key.urlsafe()))
+        self.assertIn('Imported 0', featured.data)
+        self.assertIn('Imported 1', featured.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""test_facets.py
+
+Conference facet counts recounted by the reconcile job
+
+"""
+
+import unittest
+
+import testbase
+
+
+class FacetsTest(testbase.StubTestCase):
+
+    def testReconcileCountsStoredConferences(self):
+        import facets
+        import main
+        from models import Conference
+
+        self.harness.generateCatalog(7, 0)
+        # stored without recording their facets
+        self.assertEqual(facets.getFacets(), {})
+
+        expected = {}
+        for conf in Conference.query():
+            facets.mergeDeltas(expected, facets.countDeltas({}, facets.facetValues(conf)))
+
+        # one page per task
+        defaults = facets.recountPage.__defaults__
+        facets.recountPage.__defaults__ = (None, 3)
+        try:
+            response = main.app.get_response('/crons/reconcile_facets')
+            self.assertEqual(response.status_int, 204)
+            self.assertEqual(self.runTasks('/tasks/reconcile_facets'), 2)
+        finally:
+            facets.recountPage.__defaults__ = defaults
+        self.assertEqual(facets.getFacets(), expected)
+
+        # nothing left to add
+        self.assertEqual(main.app.get_response('/crons/reconcile_facets').status_int, 204)
+        self.runTasks('/tasks/reconcile_facets')
+        self.assertEqual(facets.reconcile(expected), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
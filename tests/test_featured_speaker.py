@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""test_featured_speaker.py
+
+Featured speaker tasks of the sessions created in a batch
+
+"""
+
+import unittest
+
+import testbase
+
+
+class FeaturedSpeakerTest(testbase.StubTestCase):
+
+    def testSpeakerWithManySessions(self):
+        import conference
+        from models import SessionForm
+
+        self.harness.generateCatalog(1, 0, speakers=1)
+        conf_key, organizer = self.harness.conferences[0]
+        speaker_key = self.harness.speakers[0]
+        self.harness.asUser(organizer)
+        # far more session keys & names than fit in a task URL
+        request = conference.SESSIONS_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=conf_key.urlsafe(),
+            items=[SessionForm(sessionName='Session %d %s' % (i, 'x' * 100),
+                               speaker=speaker_key.urlsafe())
+                   for i in range(60)])
+        created = self.harness.newRequest().createSessions(request)
+        self.assertEqual(len(created.items), 60)
+
+        # one task for the speaker, naming all the sessions
+        self.assertEqual(self.runTasks('/tasks/set_featured_speaker'), 1)
+        featured = self.harness.newRequest().getFeaturedSpeaker(
+            conference.FEATURED_SPEAKER_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf_key.urlsafe()))
+        self.assertTrue(featured.data.startswith(
+            'Speaker 0 is featured speaker with session:'))
+        for i in range(60):
+            self.assertIn('Session %d x' % i, featured.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
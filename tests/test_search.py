@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""test_search.py
+
+Full-text search index of conferences: index, search, update, delete
+
+"""
+
+import unittest
+
+import testbase
+
+
+class SearchTest(testbase.StubTestCase):
+
+    def search(self, text):
+        import search
+        results, cursor = search.search(text, 20)
+        return [doc.key.id() for doc, score in results]
+
+    def testIndexSearchUpdateDelete(self):
+        import conference
+        import search
+        from models import ConferenceForm
+
+        self.harness.asUser('organizer@example.com')
+        created = self.harness.newRequest().createConference(ConferenceForm(
+            name='Python Summit', description='Talks about asyncio',
+            topics=['Programming Languages'], city='London', maxAttendees=50))
+        wsck = created.websafeKey
+
+        # index
+        self.assertEqual(self.runTasks('/tasks/index_search'), 1)
+        self.assertEqual(self.search('python'), [wsck])
+        self.assertEqual(self.search('summit asyncio'), [wsck])
+        self.assertEqual(self.search('ruby'), [])
+
+        # update
+        self.harness.newRequest().updateConference(
+            conference.CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck, name='Ruby Summit'))
+        self.runTasks('/tasks/index_search')
+        self.assertEqual(self.search('python'), [])
+        self.assertEqual(self.search('ruby summit'), [wsck])
+
+        # delete
+        from google.appengine.ext import ndb
+        key = ndb.Key(urlsafe=wsck)
+        key.delete()
+        search.scheduleIndex([key])
+        self.runTasks('/tasks/index_search')
+        self.assertEqual(self.search('ruby'), [])
+        self.assertEqual(self.search('summit'), [])
+
+    def testReputIndexesExistingConferences(self):
+        self.harness.generateCatalog(3, 0)
+        # stored before the index: not found
+        self.assertEqual(self.search('conference'), [])
+
+        import main
+        response = main.app.get_response('/admin/reput', method='POST',
+                                         POST={'kind': 'Conference'})
+        self.assertEqual(response.status_int, 204)
+        self.runTasks('/tasks/reput')
+        self.runTasks('/tasks/index_search')
+        self.assertEqual(len(self.search('synthetic conference')), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
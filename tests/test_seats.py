@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""test_seats.py
+
+Seat shards of a conference whose maxAttendees is lowered
+
+"""
+
+import unittest
+
+import testbase
+
+
+class SeatsTest(testbase.StubTestCase):
+
+    def update(self, conf_key, max_attendees):
+        import conference
+        return self.harness.newRequest().updateConference(
+            conference.CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=conf_key.urlsafe(),
+                maxAttendees=max_attendees))
+
+    def testCannotLowerBelowRegistrations(self):
+        import endpoints
+        import seats
+
+        self.harness.generateCatalog(1, 0)
+        conf_key, organizer = self.harness.conferences[0]
+        max_attendees = conf_key.get().maxAttendees
+        for email in self.harness.profiles[:3]:
+            self.harness.register(email, conf_key)
+
+        self.harness.asUser(organizer)
+        self.assertRaises(endpoints.BadRequestException, self.update, conf_key, 2)
+        self.assertEqual(conf_key.get().maxAttendees, max_attendees)
+
+        updated = self.update(conf_key, 3)
+        self.assertEqual(updated.maxAttendees, 3)
+        self.assertEqual(updated.seatsAvailable, 0)
+        self.assertEqual(seats.sumShards(conf_key.get()), 0)
+
+    def testSeatsTakenMeanwhileRaiseMaxAttendees(self):
+        import seats
+
+        self.harness.generateCatalog(1, 0)
+        conf_key, organizer = self.harness.conferences[0]
+        conf = conf_key.get()
+        max_attendees = conf.maxAttendees
+        for email in self.harness.profiles[:2]:
+            self.harness.register(email, conf_key)
+
+        # lowered to 1 after checking a single registration
+        conf.maxAttendees = 1
+        conf.put()
+        self.assertEqual(seats.adjustSeats(conf_key, 1 - max_attendees), 1)
+        conf = conf_key.get()
+        self.assertEqual(conf.maxAttendees, 2)
+        self.assertEqual(seats.sumShards(conf), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
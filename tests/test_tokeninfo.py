@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""test_tokeninfo.py
+
+OAuth user ids of tokens validated by the (fake) tokeninfo endpoint
+
+"""
+
+import threading
+import time
+import unittest
+
+import testbase
+
+
+class TokenInfoTest(testbase.StubTestCase):
+
+    def setUp(self):
+        super(TokenInfoTest, self).setUp()
+        import utils
+        self.utils = utils
+        self.tokeninfo = utils.FakeTokenInfo({
+            'good': {'user_id': '1234', 'expires_in': 600},
+            'expired': {'user_id': '5678', 'expires_in': 0},
+        })
+        utils.setTokenInfoFetcher(self.tokeninfo)
+
+    def tearDown(self):
+        self.utils.setTokenInfoFetcher(None)
+        super(TokenInfoTest, self).tearDown()
+
+    def testValidTokenIsCached(self):
+        self.assertEqual(self.utils._getTokenUserId('good'), '1234')
+        self.assertEqual(self.utils._getTokenUserId('good'), '1234')
+        self.assertEqual(self.tokeninfo.calls, 1)
+
+        # another instance finds it in memcache
+        other = self.utils.FakeTokenInfo()
+        self.utils.setTokenInfoFetcher(other)
+        self.assertEqual(self.utils._getTokenUserId('good'), '1234')
+        self.assertEqual(other.calls, 0)
+
+    def testInvalidTokens(self):
+        self.assertEqual(self.utils._getTokenUserId('unknown'), '')
+        calls = self.tokeninfo.calls
+        self.assertTrue(calls >= 1)
+        # not cached
+        self.assertEqual(self.utils._getTokenUserId('unknown'), '')
+        self.assertEqual(self.tokeninfo.calls, 2 * calls)
+        self.assertEqual(self.utils._getTokenUserId('expired'), '5678')
+        self.utils._getTokenUserId('expired')
+        self.assertEqual(self.tokeninfo.calls, 2 * calls + 2)
+
+    def testConcurrentLookupsShareOneCall(self):
+        fake = self.tokeninfo
+
+        def slowFetcher(url):
+            time.sleep(0.2)
+            return fake(url)
+        self.utils.setTokenInfoFetcher(slowFetcher)
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.utils._getTokenUserId('good')))
+            for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ['1234'] * 5)
+        self.assertEqual(fake.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""testbase.py
+
+Udacity conference server-side Python App Engine test setup: the SDK
+(from APPENGINE_SDK) on sys.path and the testbed stubs of the benchmark
+harness around every test
+
+    APPENGINE_SDK=~/google_appengine python -m unittest discover -s tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark
+benchmark.setupSdk(os.environ.get('APPENGINE_SDK'))
+
+
+class StubTestCase(unittest.TestCase):
+    """Test case running against fresh testbed stubs."""
+
+    def setUp(self):
+        from google.appengine.ext import testbed
+        self.harness = benchmark.Harness()
+        self.testbed = self.harness.testbed
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    def tearDown(self):
+        self.harness.close()
+
+    def runTasks(self, url, queue='default'):
+        """Run the push tasks queued for url through main.app (the tasks
+        they enqueue included); return the number of tasks run."""
+        import main
+        ran = 0
+        while True:
+            tasks = self.taskqueue.get_filtered_tasks(url=url, queue_names=queue)
+            if not tasks:
+                return ran
+            for task in tasks:
+                self.taskqueue.DeleteTask(queue, task.name)
+                response = main.app.get_response(
+                    task.url, method=task.method, body=task.payload or '',
+                    headers=task.headers)
+                self.assertIn(response.status_int, (200, 204), response.body)
+                ran += 1
@@ -1,11 +1,33 @@
+import hashlib
 import json
 import os
+import threading
 import time
+import urlparse
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 from models import Profile
 
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_RETRIES = 3
+TOKENINFO_BACKOFF = 0.25
+TOKENINFO_DEADLINE = 5
+MEMCACHE_TOKEN_PREFIX = 'tokeninfo:'
+MAX_TOKEN_TTL = 3600
+MAX_CACHED_TOKENS = 1000
+TOKEN_WAIT = 10
+
+# token hash -> (user id, expiry time) for this instance
+_tokenCache = {}
+# token hash -> Event set when the tokeninfo call in flight is done
+_tokenLookups = {}
+_tokenLookupsLock = threading.Lock()
+_tokenInfoFetcher = None
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -14,25 +36,7 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _getTokenUserId(token)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
@@ -43,3 +47,143 @@ def getUserId(user, id_type="email"):
             return profile.id()
         else:
             return str(uuid.uuid1().get_hex())
+
+
+def setTokenInfoFetcher(fetcher):
+    """Replace the urlfetch of the tokeninfo endpoint by fetcher(url),
+    returning a future of a response (e.g. FakeTokenInfo for offline
+    tests); None restores urlfetch. Also empties the token cache."""
+    global _tokenInfoFetcher
+    _tokenInfoFetcher = fetcher
+    _tokenCache.clear()
+
+
+def _getTokenUserId(token):
+    """Return the user id of an oauth token ('' when it is not valid).
+
+    Validated tokens are cached in the instance and in memcache until
+    they expire. Concurrent lookups of a token in the instance wait for
+    the tokeninfo call in flight (at most TOKEN_WAIT seconds) and check
+    the cache again instead of making their own; no lock is held during
+    the call, so lookups of other tokens never wait.
+    """
+    token_hash = hashlib.sha1(token).hexdigest()
+    cached = _getCachedToken(token_hash)
+    if cached:
+        return cached[0]
+
+    with _tokenLookupsLock:
+        lookup = _tokenLookups.get(token_hash)
+        owner = lookup is None
+        if owner:
+            lookup = _tokenLookups[token_hash] = threading.Event()
+    if not owner:
+        lookup.wait(TOKEN_WAIT)
+        # filled by the lookup we waited for, unless it failed
+        cached = _getCachedToken(token_hash)
+        if cached:
+            return cached[0]
+
+    try:
+        token_type = 'id_token'
+        if 'OAUTH_USER_ID' in os.environ:
+            token_type = 'access_token'
+        info = _fetchTokenInfoAsync(token, token_type).get_result()
+        user_id = info.get('user_id', '')
+        ttl = min(int(info.get('expires_in', 0)), MAX_TOKEN_TTL)
+        if not user_id or ttl <= 0:
+            return user_id
+        cached = (user_id, time.time() + ttl)
+        memcache.set(MEMCACHE_TOKEN_PREFIX + token_hash, cached, time=ttl)
+        _cacheToken(token_hash, cached)
+        return user_id
+    finally:
+        if owner:
+            with _tokenLookupsLock:
+                _tokenLookups.pop(token_hash, None)
+            lookup.set()
+
+
+def _getCachedToken(token_hash):
+    """Return the (user id, expiry time) of a validated token from the
+    instance cache, or memcache (then cached in the instance), or None."""
+    cached = _tokenCache.get(token_hash)
+    if cached and cached[1] > time.time():
+        return cached
+    cached = memcache.get(MEMCACHE_TOKEN_PREFIX + token_hash)
+    if cached and cached[1] > time.time():
+        _cacheToken(token_hash, cached)
+        return cached
+    return None
+
+
+def _cacheToken(token_hash, cached):
+    """Keep (user id, expiry time) of a token in the instance cache."""
+    if len(_tokenCache) >= MAX_CACHED_TOKENS:
+        _evictTokens()
+    _tokenCache[token_hash] = cached
+
+
+def _evictTokens():
+    """Drop the expired tokens of the instance cache, all of them when
+    it is still full."""
+    now = time.time()
+    for token_hash, (user_id, expires) in _tokenCache.items():
+        if expires <= now:
+            _tokenCache.pop(token_hash, None)
+    if len(_tokenCache) >= MAX_CACHED_TOKENS:
+        _tokenCache.clear()
+
+
+def _fetchTokenInfo(url):
+    """Return a future of the tokeninfo response for url."""
+    if _tokenInfoFetcher:
+        return _tokenInfoFetcher(url)
+    return ndb.get_context().urlfetch(url, deadline=TOKENINFO_DEADLINE)
+
+
+@ndb.tasklet
+def _fetchTokenInfoAsync(token, token_type):
+    """Return the tokeninfo of token ({} when it could not be validated),
+    retrying with backoff; an invalid id_token is tried as access_token."""
+    wait = TOKENINFO_BACKOFF
+    for attempt in range(TOKENINFO_RETRIES):
+        try:
+            resp = yield _fetchTokenInfo(TOKENINFO_URL % (token_type, token))
+        except urlfetch.Error:
+            resp = None
+        if resp and resp.status_code == 200:
+            raise ndb.Return(json.loads(resp.content))
+        if resp and resp.status_code == 400 and 'invalid_token' in resp.content:
+            token_type = 'access_token'
+        elif attempt + 1 < TOKENINFO_RETRIES:
+            yield ndb.sleep(wait)
+            wait *= 2
+    raise ndb.Return({})
+
+
+class FakeTokenInfo(object):
+    """Offline stand-in for the tokeninfo endpoint, to be installed with
+    setTokenInfoFetcher(); tokens maps a token to its tokeninfo dict
+    (user_id, expires_in) and calls counts the requests made."""
+
+    class Response(object):
+        def __init__(self, status_code, content):
+            self.status_code = status_code
+            self.content = content
+
+    def __init__(self, tokens=None):
+        self.tokens = dict(tokens or {})
+        self.calls = 0
+
+    def __call__(self, url):
+        self.calls += 1
+        query = urlparse.parse_qs(urlparse.urlparse(url).query)
+        token = (query.get('id_token') or query.get('access_token') or [''])[0]
+        if token in self.tokens:
+            resp = self.Response(200, json.dumps(self.tokens[token]))
+        else:
+            resp = self.Response(400, json.dumps({'error': 'invalid_token'}))
+        future = ndb.Future()
+        future.set_result(resp)
+        return future